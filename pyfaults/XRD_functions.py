@@ -6,15 +6,23 @@ Module containing functions related to simulating powder X-ray diffraction (PXRD
 tt_to_q --> converts 2theta values to Q values
 importFile --> import text file of PXRD data
 importExpt --> import file of experimental PXRD data and adjust 2theta range to match simulated PXRD
-fullSim --> calculates a single PXRD pattern from a CIF
+fullSim --> calculates a single PXRD pattern from a CIF with a chosen simulation engine
+multiSim --> calculates PXRD patterns for several wavelengths, or a Ka1/Ka2 doublet pattern, from a single structure factor pass
+batchSim --> calculates PXRD patterns of many supercells sharing the same lattice and atoms in one vectorized pass
+ensembleSim --> calculates the ensemble-averaged PXRD pattern of random supercells for a fault probability
 simulate --> calculates a set of PXRD patterns from all CIFs in a directory
 """
 
 #---------- import packages ----------
 import Dans_Diffraction as df
 import numpy as np
-import os, glob
+import os, glob, shutil
 
+
+
+# Cu Ka1/Ka2 wavelengths in Angstroms and relative intensities, for use with multiSim
+cuKaWLs = [1.540593, 1.544427]
+cuKaWeights = [2/3, 1/3]
 #-------------------------------------
 #--------- FUNCTION: tt_to_q ---------
 #-------------------------------------
@@ -48,12 +56,12 @@ def importFile(path, filename, *, ext='.txt', norm=True):
 
     Parameters
     ----------
-    path : str
-        Directory where data file is stored
+    path : str or RunArchive
+        Directory where data file is stored, or run archive (export_functions) holding simulated patterns
     filename : str
-        Name of data file
+        Name of data file, or tag of a simulated pattern in a run archive
     ext : str, optional
-        file extension, by default '.txt'
+        file extension, by default '.txt'; not used for run archives
     norm : bool, optional
         Set to true to normalize intensity values and False otherwise, by default True
 
@@ -65,6 +73,11 @@ def importFile(path, filename, *, ext='.txt', norm=True):
         Imported intensity values
     """
     
+    if not isinstance(path, str):
+        with path.open(path.patternMember(filename)) as f:
+            q, ints = np.loadtxt(f, unpack=True, dtype=float)
+        return q, ints
+
     q, ints = np.loadtxt(path + filename + ext, unpack=True, dtype=float)
     return q, ints
 
@@ -121,26 +134,38 @@ def importExpt(path, filename, wl, maxTT, *, ext='.txt'):
 #-------------------------------------
 #--------- FUNCTION: fullSim ---------
 #-------------------------------------
-def fullSim(path, cif, wl, tt_max, savePath, *, pw=0.0, bg=0):
+def fullSim(path, cif, wl, tt_max, savePath, *, pw=0.0, bg=0, engine='dans', engineOptions=None, require=('periodic',),
+            writer=None):
     """
     Simulates a powder X-ray diffraction pattern from a CIF and exports data
 
     Parameters
     ----------
-    path : str
-        File path to directory where CIF is stored
+    path : str or RunArchive
+        File path to directory where CIF is stored, or run archive (export_functions) holding it
     cif : str
-        Name of CIF
+        Name of CIF, or its tag in a run archive
     wl : float
         Simulated instrument wavelength in units of Angstroms
     tt_max : float
         Maximum 2theta in units of degrees
-    savePath : str
-        File path to directory to save diffraction data to
+    savePath : str or RunArchive
+        File path to directory to save diffraction data to, or run archive to save it to as simulations/<cif>_sim.txt
     pw : float, optional
         Artificial peak broadening term, by default None
     bg : float, optional
         Average of normal instrument background, by default None
+    engine : str, optional
+        Name of a registered simulation engine (see engine_functions), or 'auto' for the fastest engine with the required
+        capabilities that supports the given pw, bg and engineOptions, by default 'dans'
+    engineOptions : dict, optional
+        Further keyword arguments of the engine, e.g. {'precision': 'single', 'windows': [[1.0, 2.5]], 'memLimit': 2**28} for
+        the native engine; with engine='auto' only the options listed in engine_functions.optionCapabilities restrict the
+        choice, by default None
+    require : tuple of str, optional
+        Capabilities an 'auto' engine must have, e.g. ('finiteSize',) for the debye engine, by default ('periodic',)
+    writer : BackgroundWriter, optional
+        Background writer (export_functions) to queue the export of the pattern on, by default None (write immediately)
 
     Returns
     -------
@@ -149,37 +174,322 @@ def fullSim(path, cif, wl, tt_max, savePath, *, pw=0.0, bg=0):
     ints : nparray
         Normalized diffraction pattern intensity values in arbitrary units / counts
     """
+    from pyfaults.engine_functions import getEngine, findEngine, optionCapabilities
+    from pyfaults.export_functions import writePattern
+
+    if engineOptions is None:
+        engineOptions = {}
+    if engine == 'auto':
+        needs = list(require) + ['peakWidth']*bool(pw) + ['background']*bool(bg)
+        needs += [option for option in engineOptions if option in optionCapabilities]
+        engine = findEngine(*needs)
 
-    # load CIF as crystal structure readable by Dans_Diffraction
-    struct = df.Crystal(path + cif + '.cif')
-    
-    # calculate energy in keV from wavelength
-    energy_kev = df.fc.wave2energy(wl)
-    # set scattering source type to X-rays
-    struct.Scatter.setup_scatter('xray')
-    # calculate maximum wavevector from maximum 2theta and energy
-    wavevector_max = df.fc.calqmag(tt_max, energy_kev)
-    
     # calculate PXRD pattern
-    q, ints = struct.Scatter.generate_powder(wavevector_max, 
-                                             peak_width=pw, 
-                                             background=bg, 
-                                             powder_average=True)
+    q, ints = getEngine(engine)(path, cif, wl, tt_max, pw=pw, bg=bg, **engineOptions)
     
     # export diffraction pattern to text file
-    with open(savePath + cif + '_sim.txt', 'w') as f:
-        for (q, ints) in zip(q, ints):
-            f.write('{0} {1}\n'.format(q, ints))
-    f.close() 
+    if isinstance(savePath, str):
+        fileName, archive = savePath + cif + '_sim.txt', None
+    else:
+        fileName, archive = savePath.patternMember(cif), savePath
+    if writer is not None:
+        writer.submit(writePattern, fileName, q, ints, archive=archive)
+    else:
+        writePattern(fileName, q, ints, archive=archive)
     
     return q, ints 
 
 
 
+#-------------------------------------
+#-------- FUNCTION: multiSim ---------
+#-------------------------------------
+def multiSim(path, cif, wls, tt_max, savePath, *, weights=None, pw=0.0, bg=0, lp=False):
+    """
+    Simulates powder X-ray diffraction patterns at several wavelengths, or a single pattern of a weighted multi-wavelength source
+    such as a Cu Ka1/Ka2 doublet, from a CIF; structure factors are calculated once and only the Q range, intensity correction and
+    peak broadening are repeated per wavelength
+
+    Parameters
+    ----------
+    path : str
+        File path to directory where CIF is stored
+    cif : str
+        Name of CIF
+    wls : list of float
+        Simulated instrument wavelengths in units of Angstroms, e.g. cuKaWLs
+    tt_max : float
+        Maximum 2theta in units of degrees
+    savePath : str
+        File path to directory to save diffraction data to
+    weights : list of float, optional
+        Relative intensity of each wavelength, e.g. cuKaWeights; if given, a single pattern on the Q axis of the first wavelength is
+        exported to <cif>_sim.txt, otherwise each pattern is exported to <cif>_sim_wl<i>.txt, by default None
+    pw : float, optional
+        Artificial peak broadening term, by default 0.0
+    bg : float, optional
+        Average of normal instrument background, by default 0
+    lp : bool, optional
+        Set to True to apply Lorentz-polarization factors instead of the powder averaging correction, by default False
+
+    Returns
+    -------
+    patterns : list of [nparray, nparray] or [nparray, nparray]
+        Q and intensity values of each pattern, or of the single weighted pattern if weights are given
+    """
+    from pyfaults.scattering_functions import multiPattern
+    from pyfaults.engine_functions import loadCrystal
+
+    # load CIF as crystal structure readable by Dans_Diffraction
+    struct = loadCrystal(path, cif)
+    struct.Scatter.setup_scatter('xray')
+
+    # reflections up to the maximum Q of the shortest wavelength
+    qMax = tt_to_q(tt_max, min(wls))
+    hmax, kmax, lmax = df.fc.maxHKL(qMax, struct.Cell.UVstar())
+    hkl = df.fc.genHKL([hmax, -hmax], [kmax, -kmax], [lmax, -lmax])
+    qmag = struct.Cell.Qmag(hkl)
+    keep = (qmag > 0) & (qmag < qMax)
+    hkl, qmag = hkl[keep], qmag[keep]
+
+    # single structure factor pass
+    ints = struct.Scatter.intensity(hkl)
+
+    patterns = multiPattern(qmag, ints, wls, tt_max, weights=weights, pw=pw, bg=bg, lp=lp)
+
+    if weights is not None:
+        np.savetxt(savePath + cif + '_sim.txt', np.column_stack(patterns))
+    else:
+        for i in range(len(patterns)):
+            np.savetxt(savePath + cif + '_sim_wl' + str(i+1) + '.txt', np.column_stack(patterns[i]))
+
+    return patterns
+
+
+
+#-------------------------------------
+#--------- FUNCTION: batchSim --------
+#-------------------------------------
+def batchSim(cells, wl, tt_max, *, pw=0.0, bg=0, windows=None, dedupe=True, precision='double', memLimit=None):
+    """
+    Simulates powder X-ray diffraction patterns of many supercells in one vectorized pass, without writing or parsing CIFs; all
+    supercells must share the same lattice and the same atoms in the same order, as for a probability / stacking vector sweep over
+    one unit cell. With dedupe (the default) every supercell still gets its own row of intensities, duplicates sharing the
+    pattern of their first occurrence, and the number of structures actually simulated is returned as well
+
+    Parameters
+    ----------
+    cells : list of Supercell or Unitcell
+        Structures to simulate
+    wl : float
+        Simulated instrument wavelength in units of Angstroms
+    tt_max : float
+        Maximum 2theta in units of degrees
+    pw : float, optional
+        Artificial peak broadening term, by default 0.0
+    bg : float, optional
+        Average of normal instrument background, by default 0
+    windows : list of nparray, optional
+        Q windows formatted as [[qMin, qMax], ...]; only reflections within 3 peak widths of a window are simulated and only pattern
+        points inside the windows are returned, by default None (full Q range)
+    dedupe : bool, optional
+        Set to True to simulate supercells with the same stacking sequence up to a cyclic shift (and the same fault parameters
+        and intercalation layer) only once, by default True
+    precision : str, optional
+        'double' or 'single', by default 'double'
+    memLimit : int, optional
+        Memory budget in bytes for the intermediates of one structure factor tile, by default None
+
+    Returns
+    -------
+    q : nparray
+        Diffraction pattern Q values in units of inverse Angstroms
+    ints : nparray
+        Diffraction pattern intensity values with shape (cells, Q)
+    nUnique : int
+        Number of simulated (unique) structures, only returned if dedupe is True
+    """
+    from pyfaults.scattering_functions import atomArrays
+
+    latt = cells[0].lattice
+    lattParams = [latt.a, latt.b, latt.c, latt.alpha, latt.beta, latt.gamma]
+
+    xyzList = []
+    for cell in cells:
+        cellLatt = cell.lattice
+        if not np.allclose([cellLatt.a, cellLatt.b, cellLatt.c, cellLatt.alpha, cellLatt.beta, cellLatt.gamma], lattParams):
+            raise ValueError('All supercells in a batch must share the same lattice')
+        xyz, elements, occ, biso = atomArrays(cell.layers)
+        if len(xyzList) == 0:
+            refElements, refOcc, refBiso = elements, occ, biso
+        elif not (np.array_equal(elements, refElements) and np.array_equal(occ, refOcc) and np.array_equal(biso, refBiso)):
+            raise ValueError('All supercells in a batch must contain the same atoms in the same order')
+        xyzList.append(xyz)
+
+    xyz = np.array(xyzList)
+    inverse = np.arange(len(cells))
+    if dedupe and all(hasattr(cell, 'sequence') for cell in cells):
+        unique, inverse = _uniqueCells(cells)
+        xyz = xyz[unique]
+
+    q, ints = batchPattern(xyz, refElements, refOcc, refBiso, latt, wl, tt_max, pw=pw, windows=windows, precision=precision,
+                           memLimit=memLimit)
+    ints = ints[inverse]
+    if bg:
+        ints = ints + np.random.normal(bg, np.sqrt(bg), ints.shape).astype(ints.dtype)
+    if dedupe:
+        return q, ints, len(xyz)
+    return q, ints
+
+def _uniqueCells(cells):
+    """
+    Unique structures among supercells, comparing stacking sequences up to a cyclic shift along with the fault parameters and
+    the atoms of the intercalation layer
+    """
+    from pyfaults.structure_functions import uniqueSequences
+    from pyfaults.scattering_functions import atomArrays
+
+    # supercells with different fault parameters never share a structure, so each parameter set gets its own label
+    params = []
+    for cell in cells:
+        intAtoms = None
+        if cell.intLayer is not None:
+            xyz, elements, occ, biso = atomArrays([cell.intLayer])
+            intAtoms = [list(elements), np.round(xyz, 8).tolist(), occ.tolist(), biso.tolist()]
+        vec = np.round(np.append(cell.stackVec, 0)[:3].astype(float), 8).tolist()
+        params.append(str([cell.fltLayer, vec, cell.zAdj, intAtoms]))
+    labels = np.unique(params, return_inverse=True)[1].reshape(-1, 1)
+    return uniqueSequences([cell.sequence for cell in cells], stackVecs=labels)
+
+
+
+#-------------------------------------
+#------- FUNCTION: ensembleSim -------
+#-------------------------------------
+def ensembleSim(unitcell, nStacks, fltLayer, stackVec, stackProb, wl, tt_max, *, nReal=10, sampling='stratified', pw=0.0, bg=0,
+                seed=None, precision='double'):
+    """
+    Simulates the ensemble-averaged powder X-ray diffraction pattern of random supercells with a given fault probability; each
+    realization only recalculates the stacks that differ from the previous one (see scattering_functions.IncrementalPattern).
+    Stratified sampling by number of faults converges with far fewer realizations than independent random supercells
+
+    Parameters
+    ----------
+    unitcell : Unitcell
+        Unit cell used to construct supercells
+    nStacks : int
+        Number of unit cells stacked to generate supercell
+    fltLayer : str
+        Name of layer to apply stacking fault parameters to
+    stackVec : nparray
+        Displacement vector [x,y,z] of a faulted stack in fractional supercell coordinates
+    stackProb : float
+        Probability stacking fault will occur
+    wl : float
+        Simulated instrument wavelength in units of Angstroms
+    tt_max : float
+        Maximum 2theta in units of degrees
+    nReal : int, optional
+        Number of supercell realizations averaged, by default 10
+    sampling : str, optional
+        'stratified' or 'random', see structure_functions.sampleSequences, by default 'stratified'
+    pw : float, optional
+        Artificial peak broadening term, by default 0.0
+    bg : float, optional
+        Average of normal instrument background, by default 0
+    seed : int, optional
+        Random number generator seed, by default None
+    precision : str, optional
+        'double' or 'single', by default 'double'
+
+    Returns
+    -------
+    q : nparray
+        Diffraction pattern Q values in units of inverse Angstroms
+    ints : nparray
+        Ensemble-averaged diffraction pattern intensity values
+    """
+    from pyfaults.scattering_functions import IncrementalPattern
+    from pyfaults.structure_functions import sampleSequences
+
+    sequences, weights = sampleSequences(nStacks, stackProb, nReal, sampling=sampling, seed=seed)
+    ip = IncrementalPattern(unitcell, nStacks, fltLayer, stackVec, wl, tt_max, precision=precision)
+
+    ints = 0
+    for seq, weight in zip(sequences, weights):
+        for n in np.flatnonzero((seq != 0) != ip.faulted):
+            ip.toggleStack(n)
+        q, pattern = ip.pattern(pw=pw)
+        ints = ints + weight*pattern
+
+    if bg:
+        ints = ints + np.random.normal(bg, np.sqrt(bg), ints.shape).astype(ints.dtype)
+    return q, ints
+
+
+
+#-------------------------------------
+#------- FUNCTION: batchPattern ------
+#-------------------------------------
+def batchPattern(xyz, elements, occ, biso, lattice, wl, tt_max, *, pw=0.0, bg=0, windows=None, precision='double', memLimit=None):
+    """
+    Simulates powder X-ray diffraction patterns from a coordinate tensor of many models sharing the same lattice and atoms
+
+    Parameters
+    ----------
+    xyz : nparray
+        Fractional atomic positions with shape (models, atoms, 3)
+    elements : nparray
+        Element of each atom
+    occ : nparray
+        Site occupancy of each atom
+    biso : nparray
+        Isotropic atomic displacement parameter of each atom
+    lattice : Lattice
+        Lattice parameters shared by all models
+    wl : float
+        Simulated instrument wavelength in units of Angstroms
+    tt_max : float
+        Maximum 2theta in units of degrees
+    pw : float, optional
+        Artificial peak broadening term, by default 0.0
+    bg : float, optional
+        Average of normal instrument background, by default 0
+    windows : list of nparray, optional
+        Q windows formatted as [[qMin, qMax], ...]; only reflections within 3 peak widths of a window are simulated and only pattern
+        points inside the windows are returned, by default None (full Q range)
+    precision : str, optional
+        'double' or 'single', by default 'double'
+    memLimit : int, optional
+        Memory budget in bytes for the intermediates of one structure factor tile, by default None
+
+    Returns
+    -------
+    q : nparray
+        Diffraction pattern Q values in units of inverse Angstroms
+    ints : nparray
+        Diffraction pattern intensity values with shape (models, Q)
+    """
+    from pyfaults.scattering_functions import genHKL, windowReflections, batchStructureFactor, powderPattern
+
+    qMax = tt_to_q(tt_max, wl)
+    hkl, qmag = genHKL(lattice, qMax)
+    if windows is not None:
+        keep = windowReflections(qmag, windows, 3*pw)
+        hkl, qmag = hkl[keep], qmag[keep]
+
+    sf = batchStructureFactor(hkl, qmag, xyz, elements, occ, biso, precision=precision, memLimit=memLimit)
+    # each reflection stands for itself and its Friedel mate
+    ints = 2 * (sf.real**2 + sf.imag**2)
+
+    return powderPattern(qmag, ints, qMax, pw=pw, bg=bg, windows=windows, precision=precision)
+
+
+
 #-------------------------------------
 #-------- FUNCTION: simulate ---------
 #-------------------------------------
-def simulate(path):
+def simulate(path, *, engine='dans', engineOptions=None, require=('periodic',), archive=None):
     """
     Simulates powder X-ray diffraction patterns of all CIFs in a given directory
 
@@ -187,24 +497,60 @@ def simulate(path):
     ----------
     path : str
         File path of directory where CIFs are stored
+    engine : str, optional
+        Name of a registered simulation engine, or 'auto' for the fastest one supporting the simulation parameters,
+        by default 'dans'
+    engineOptions : dict, optional
+        Further keyword arguments of the engine, see fullSim, by default None
+    require : tuple of str, optional
+        Capabilities an 'auto' engine must have, see fullSim, by default ('periodic',)
+    archive : RunArchive, optional
+        Run archive (export_functions) opened for adding members, holding the CIFs from genSupercells; patterns are saved to
+        the same archive instead of the 'simulations' folder, by default None
     """
     
-    import pyfaults as pf
+    from pyfaults.inputfile_functions import pfInput
+    from pyfaults.export_functions import BackgroundWriter
     
-    unitcell, ucDF, gsDF, scDF, simDF = pf.pfInput.pfInput(path)
+    unitcell, ucDF, gsDF, scDF, simDF = pfInput(path)
 
     wl = simDF.loc[0, 'wl']
     maxTT = simDF.loc[0, 'maxTT']
     pw = simDF.loc[0, 'pw']
     
+    if archive is not None:
+        # CIFs and patterns are members of the archive
+        with BackgroundWriter() as writer:
+            for f in archive.tags('cif'):
+                fullSim(archive, f, wl.iloc[0], maxTT.iloc[0], pw=pw.iloc[0], savePath=archive, engine=engine,
+                        engineOptions=engineOptions, require=require, writer=writer)
+
+        if archive.exists('supercells/duplicates.txt'):
+            for line in archive.read('supercells/duplicates.txt').splitlines():
+                cellTag, sameAs = line.split()
+                if archive.exists(archive.cifMember(cellTag)):
+                    continue
+                archive.write(archive.patternMember(cellTag), archive.read(archive.patternMember(sameAs)))
+        return
+
     # creates folder to store generated data
     if os.path.exists('./simulations') == False:
         os.mkdir('./simulations')
 
-    fileList = glob.glob('./supercells/*')
-    for f in range(len(fileList)):
-        fileList[f] = fileList[f].replace('.cif', '')
-        fileList[f] = fileList[f].replace('./supercells\\', '')
+    fileList = [os.path.basename(f)[:-len('.cif')] for f in glob.glob('./supercells/*.cif')]
+    
+    # patterns are exported in the background while the next CIF is simulated
+    with BackgroundWriter() as writer:
+        for f in fileList:
+            q, ints = fullSim('./supercells/', f, wl.iloc[0], maxTT.iloc[0], pw=pw.iloc[0], savePath='./simulations/',
+                              engine=engine, engineOptions=engineOptions, require=require, writer=writer)
     
-    for f in fileList:
-        q, ints = pf.simXRD.fullSim('./supercells/', f, wl.iloc[0], maxTT.iloc[0], pw=pw.iloc[0], savePath='./simulations/')
\ No newline at end of file
+    # supercells identical to an already simulated structure share its pattern; tags with their own CIF (from a later run
+    # without dedupe) were simulated above
+    if os.path.exists('./supercells/duplicates.txt'):
+        with open('./supercells/duplicates.txt', 'r') as dupFile:
+            for line in dupFile:
+                cellTag, sameAs = line.split()
+                if os.path.exists('./supercells/' + cellTag + '.cif'):
+                    continue
+                shutil.copyfile('./simulations/' + sameAs + '_sim.txt', './simulations/' + cellTag + '_sim.txt')
@@ -12,12 +12,14 @@ fitDiff --> calculates the difference between two difference curves
 simR2vals --> calculates R^2 values for each simulated PXRD pattern in a file directory against experimental PXRD data, generates text file report
 stepGridSearch --> generates a step-wise set of stacking vectors and fault probabilities
 randGridSearch --> generates a random set of stacking vectors and fault probabilities
+rmcFit --> reverse Monte Carlo refinement of an explicit stacking sequence against experimental PXRD data
+screenGridSearch --> multi-fidelity screening of fault probability and stacking vector candidates against experimental PXRD data
 """
 
 #---------- import packages ----------
 import numpy as np
 import sklearn.metrics as skl
-import glob, random
+import glob, os, random, time
 
 
 
@@ -46,14 +48,9 @@ def getNormVals(q, ints):
     intsMin: float
         Minimum intensity value
     """
-    intsMax = 0
-    maxIndex = 0
-    
-    for i in range(len(ints)):
-        if ints[i] > intsMax:
-            intsMax = ints[i]
-            maxIndex = i
-            
+    from pyfaults.kernel_functions import maxIndex as findMax
+
+    intsMax, maxIndex = findMax(ints)
     qAtIntsMax = q[maxIndex]
     
     intsMin = np.min(ints)
@@ -84,23 +81,12 @@ def normalizeToExpt(exptQ, exptInts, q, ints):
     normInts: nparray
         Simulated intensity values normalized to experimental data
     """
+    from pyfaults.kernel_functions import normalizeWindow
+
     intsMax, qAtIntsMax, maxIndex, intsMin = getNormVals(exptQ, exptInts)
     
     qRange = [qAtIntsMax-0.1, qAtIntsMax+0.1]
-    
-    normMax = 0
-    for i in range(len(q)):
-        if q[i] >= qRange[0] and q[i] <= qRange[1]:
-            if ints[i] > normMax:
-                normMax = ints[i]
-    
-    normInts = []
-
-    for i in range(len(ints)):
-        if ints[i] > 0:
-            normInts.append(ints[i] / normMax)
-        else:
-            normInts.append(0.0)
+    normInts = normalizeWindow(q, ints, qRange[0], qRange[1])
             
     return normInts
 
@@ -130,17 +116,12 @@ def diffCurve(q1, q2, ints1, ints2):
     diff_ints : nparray
         Intensity values of difference curve
     """
-    diff_q_list = []
-    diff_ints_list = []
-    for i in range(0, len(q1)):
-        q1_val = float('%.3f'%(q1[i]))
-        for j in range(0, len(q2)):
-            q2_val = float('%.3f'%(q2[j]))
-            if q1_val == q2_val:
-                diff_q_list.append(q1_val)
-                diff_ints_list.append(ints1[i]-ints2[j])
-    diff_q = np.array(diff_q_list)
-    diff_ints = np.array(diff_ints_list)
+    from pyfaults.kernel_functions import matchQ
+
+    # pair up points with equal Q to 3 decimal places
+    i1, i2 = matchQ(q1, q2)
+    diff_q = np.round(np.asarray(q1, dtype=float)[i1], 3)
+    diff_ints = np.asarray(ints1)[i1] - np.asarray(ints2)[i2]
         
     return diff_q, diff_ints
 
@@ -149,7 +130,7 @@ def diffCurve(q1, q2, ints1, ints2):
 #-------------------------------------
 #---------- FUNCTION: r2val ----------
 #-------------------------------------
-def r2val(q1, q2, ints1, ints2):
+def r2val(q1, q2, ints1, ints2, *, windows=None):
     """
     Calculates an R^2 value between two sets of PXRD data
 
@@ -163,25 +144,24 @@ def r2val(q1, q2, ints1, ints2):
         Dataset 1 intensity values
     ints2 : nparray
         Dataset 2 intensity values
+    windows : list of nparray or nparray of bool, optional
+        Q windows formatted as [[qMin, qMax], ...], or a boolean mask over dataset 1, restricting which points are compared,
+        by default None (all points)
 
     Returns
     -------
     r2 : float
         Calculated R^2 value
     """    
-    q_list = []
-    ints1_list = []
-    ints2_list = []
-    for i in range(len(q1)):
-        q1_val = float('%.3f'%(q1[i]))
-        for j in range(len(q2)):
-            q2_val = float('%.3f'%(q2[j]))
-            if q1_val == q2_val:
-                q_list.append(q1_val)
-                ints1_list.append(ints1[i])
-                ints2_list.append(ints2[j])
-    ints1_arr = np.array(ints1_list)
-    ints2_arr = np.array(ints2_list)
+    from pyfaults.kernel_functions import matchQ
+
+    # pair up points with equal Q to 3 decimal places
+    i1, i2 = matchQ(q1, q2)
+    if windows is not None:
+        sel = _windowMask(q1, windows)[i1]
+        i1, i2 = i1[sel], i2[sel]
+    ints1_arr = np.asarray(ints1)[i1]
+    ints2_arr = np.asarray(ints2)[i2]
 
     r2 = skl.r2_score(ints1_arr, ints2_arr)
 
@@ -216,20 +196,13 @@ def diff_r2(q1, q2, ints1, ints2):
     diff_ints : nparray
         Intensity values of difference curve
     """
-    
-    q_list = []
-    ints1_list = []
-    ints2_list = []
-    for i in range(len(q1)):
-        q1_val = float('%.3f'%(q1[i]))
-        for j in range(len(q2)):
-            q2_val = float('%.3f'%(q2[j]))
-            if q1_val == q2_val:
-                q_list.append(q1_val)
-                ints1_list.append(ints1[i])
-                ints2_list.append(ints2[j])
-    ints1_arr = np.array(ints1_list)
-    ints2_arr = np.array(ints2_list)
+    from pyfaults.kernel_functions import matchQ
+
+    # pair up points with equal Q to 3 decimal places
+    i1, i2 = matchQ(q1, q2)
+    q_list = np.round(np.asarray(q1, dtype=float)[i1], 3).tolist()
+    ints1_arr = np.asarray(ints1)[i1]
+    ints2_arr = np.asarray(ints2)[i2]
     diff_ints = np.subtract(ints1_arr, ints2_arr)
 
     r2 = skl.r2_score(ints1_arr, ints2_arr)
@@ -265,7 +238,7 @@ def fitDiff(diff_ints1, diff_ints2):
 #-------------------------------------
 #-------- FUNCTION: simR2vals --------
 #-------------------------------------
-def simR2vals(exptPath, exptFN, exptWL, maxTT):
+def simR2vals(exptPath, exptFN, exptWL, maxTT, *, archive=None, store=None, runId=None):
     """
     Calculates R^2 values for each simulated PXRD pattern in a file directory against experimental PXRD data, generates text file report
 
@@ -279,6 +252,13 @@ def simR2vals(exptPath, exptFN, exptWL, maxTT):
         Instrument wavelength in Angstroms
     maxTT : float
         Maximum two theta in degrees
+    archive : RunArchive, optional
+        Run archive (export_functions) to read the simulated patterns from instead of the 'simulations' folder, by default None
+    store : ResultsStore, optional
+        Results store (results_functions) to add the R^2 values to as scores against experiment exptFN, matched to the
+        parameter points of the run by supercell tag, by default None
+    runId : int, optional
+        Identifier of the run in store, e.g. the run passed to genSupercells, by default None (a new run)
 
     Returns
     -------
@@ -291,22 +271,32 @@ def simR2vals(exptPath, exptFN, exptWL, maxTT):
     
     expt_q, expt_ints = importExpt(exptPath, exptFN, exptWL, maxTT)
     
-    sims = glob.glob('./simulations/*.txt')
-    
-    for f in sims:
-        removeExt = f.split('.')
-        fn = removeExt[0].split('\\')
-        
-        q, ints = importFile('./simulations/', fn[-1])
-        r2 = r2val(expt_q, q, expt_ints, ints)
+    if archive is not None:
+        # patterns are read from the archive one member at a time
+        for tag in archive.tags('pattern'):
+            q, ints = importFile(archive, tag)
+            r2vals.append([tag + '_sim', r2val(expt_q, q, expt_ints, ints)])
+    else:
+        sims = glob.glob('./simulations/*.txt')
         
-        r2vals.append([fn[-1], r2])
+        for f in sims:
+            fn = os.path.splitext(os.path.basename(f))[0]
+            
+            q, ints = importFile('./simulations/', fn)
+            r2 = r2val(expt_q, q, expt_ints, ints)
+            
+            r2vals.append([fn, r2])
         
     with open('./r2vals.txt', 'w') as x:
-        for i in range(len(r2vals)):
-            for (fn, r2) in zip(r2vals[i][0], r2vals[i][1]):
-                x.write('{0} {1}\n'.format(fn, r2))
-        x.close()
+        for (fn, r2) in r2vals:
+            x.write('{0} {1}\n'.format(fn, r2))
+
+    # one batch of scores per experiment, keyed by supercell tag
+    if store is not None:
+        if runId is None:
+            runId = store.addRun(exptFN)
+        tags = [fn[:-len('_sim')] if fn.endswith('_sim') else fn for (fn, r2) in r2vals]
+        store.addScores(runId, exptFN, [[tag, r2] for tag, (fn, r2) in zip(tags, r2vals)])
 
     return r2vals
 
@@ -402,4 +392,313 @@ def randGridSearch(pRange, sxRange, syRange, numVec):
         sy = random.randrange(syRange[0], syRange[1])
         sList.append(sx, sy, 0)
     
-    return np.array(pList), np.array(sList)
\ No newline at end of file
+    return np.array(pList), np.array(sList)
+
+
+
+#-------------------------------------
+#---------- FUNCTION: rmcFit ---------
+#-------------------------------------
+def rmcFit(unitcell, nStacks, fltLayer, stackVec, exptQ, exptInts, wl, maxTT, *, start=None, moveVecs=None, nMoves=100000,
+           temp=1e-4, pw=0.0, windows=None, refreshEvery=10000, checkpoint=None, checkpointEvery=1000, seed=None,
+           precision='double'):
+    """
+    Reverse Monte Carlo refinement of an explicit stacking sequence against experimental PXRD data; each move displaces the
+    fault layer of one random stack and is accepted or rejected with the Metropolis criterion on R^2
+
+    Parameters
+    ----------
+    unitcell : Unitcell
+        Unit cell used to construct supercell
+    nStacks : int
+        Number of unit cells stacked to generate supercell
+    fltLayer : str
+        Name of layer to apply stacking fault parameters to
+    stackVec : nparray
+        Displacement vector [x,y,z] of a faulted stack in fractional supercell coordinates
+    exptQ : nparray
+        Experimental Q values in inverse Angstroms
+    exptInts : nparray
+        Experimental intensity values
+    wl : float
+        Instrument wavelength in Angstroms
+    maxTT : float
+        Maximum 2theta in degrees
+    start : Supercell, nparray or str, optional
+        Starting sequence as a Supercell, a stacking sequence or boolean array of faulted stacks, an array of per-stack displacement vectors, or the
+        file path of a checkpoint written by a previous run, by default None (no faults)
+    moveVecs : list of nparray, optional
+        Displacement vectors a stack may be moved to in addition to no displacement, by default None ([stackVec])
+    nMoves : int, optional
+        Number of proposed moves, by default 100000
+    temp : float, optional
+        Metropolis temperature in units of R^2, by default 1e-4
+    pw : float, optional
+        Artificial peak broadening term, by default 0.0
+    windows : list of nparray or nparray of bool, optional
+        Q windows formatted as [[qMin, qMax], ...], or a boolean mask over the experimental data, to fit; only reflections
+        contributing to the windows are simulated, by default None (full Q range)
+    refreshEvery : int, optional
+        Number of moves between exact recalculations of the running structure factor, by default 10000
+    checkpoint : str, optional
+        File path (.npz) to save the best sequence to, by default None
+    checkpointEvery : int, optional
+        Number of moves between checkpoints, by default 1000
+    seed : int, optional
+        Random number generator seed, by default None
+    precision : str, optional
+        'double' or 'single' precision of simulated amplitudes and patterns, by default 'double'
+
+    Returns
+    -------
+    bestShifts : nparray
+        Per-stack displacement vectors of the best sequence found
+    bestR2 : float
+        R^2 value of the best sequence
+    r2List : nparray
+        R^2 value of the current sequence after each move
+    """
+    from pyfaults.scattering_functions import IncrementalPattern, getWindows
+
+    rng = np.random.default_rng(seed)
+    exptQ = np.asarray(exptQ, dtype=float)
+    exptInts = np.asarray(exptInts, dtype=float)
+
+    if windows is not None:
+        sel = _windowMask(exptQ, windows)
+        windows = getWindows(exptQ, sel)
+        exptQ, exptInts = exptQ[sel], exptInts[sel]
+
+    if moveVecs is None:
+        moveVecs = [stackVec]
+    choices = np.vstack([np.zeros(3), np.array(moveVecs, dtype=float).reshape(-1, 3)])
+
+    ip = IncrementalPattern(unitcell, nStacks, fltLayer, stackVec, wl, maxTT, windows=windows, margin=3*pw, precision=precision)
+    for n, shift in enumerate(_rmcStart(start, nStacks, fltLayer, stackVec)):
+        ip.setStack(n, shift)
+    ip.refresh()
+
+    r2 = _rmcScore(ip, exptQ, exptInts, pw)
+    bestR2 = r2
+    bestShifts = ip.shifts
+    saved = False
+    r2List = np.empty(nMoves)
+
+    for i in range(nMoves):
+        n = rng.integers(nStacks)
+        old = ip.shifts[n]
+        new = choices[rng.integers(len(choices))]
+        if np.array_equal(old, new):
+            r2List[i] = r2
+            continue
+
+        ip.setStack(n, new)
+        newR2 = _rmcScore(ip, exptQ, exptInts, pw)
+
+        # Metropolis criterion
+        if newR2 >= r2 or rng.random() < np.exp((newR2 - r2) / temp):
+            r2 = newR2
+            if r2 > bestR2:
+                bestR2 = r2
+                bestShifts = ip.shifts
+                saved = False
+        else:
+            ip.setStack(n, old)
+        r2List[i] = r2
+
+        if (i+1) % refreshEvery == 0:
+            ip.refresh()
+        if checkpoint is not None and not saved and (i+1) % checkpointEvery == 0:
+            np.savez(checkpoint, shifts=bestShifts, r2=bestR2, move=i+1)
+            saved = True
+
+    if checkpoint is not None:
+        np.savez(checkpoint, shifts=bestShifts, r2=bestR2, move=nMoves)
+
+    return bestShifts, bestR2, r2List
+
+
+
+#-------------------------------------
+#----- FUNCTION: screenGridSearch ----
+#-------------------------------------
+def screenGridSearch(unitcell, fltLayer, probList, sVecList, exptQ, exptInts, wl, maxTT, *, ladder=None, keep=0.1, pw=0.0,
+                     sampling='stratified', commonRandom=False, seed=None, precision='double', report=None):
+    """
+    Multi-fidelity screening of fault probability and stacking vector candidates against experimental PXRD data; every candidate
+    is simulated at the cheapest fidelity and only the best fraction is promoted to the next, more expensive one
+
+    Parameters
+    ----------
+    unitcell : Unitcell
+        Unit cell used to construct supercells
+    fltLayer : str
+        Name of layer to apply stacking fault parameters to
+    probList : nparray
+        Set of fault probabilities, e.g. from stepGridSearch or randGridSearch
+    sVecList : nparray
+        Set of stacking vectors [x,y,z] in fractional supercell coordinates
+    exptQ : nparray
+        Experimental Q values in inverse Angstroms
+    exptInts : nparray
+        Experimental intensity values
+    wl : float
+        Instrument wavelength in Angstroms
+    maxTT : float
+        Maximum 2theta in degrees
+    ladder : list of list, optional
+        Fidelity of each stage from cheapest to full, formatted as [[nStacks, qStep, nReal], ...] where qStep is the Q spacing
+        in inverse Angstroms of the simulated pattern grid and of the experimental data resampled to it (None uses the full
+        pattern grid and the data as is) and nReal is the number of random stacking sequences averaged, by default None
+        ([[10, 0.02, 1], [100, None, 1]])
+    keep : float or list of float, optional
+        Fraction of candidates promoted after each stage, either one value for all stages or one per promotion, by default 0.1
+    pw : float, optional
+        Artificial peak broadening term, by default 0.0
+    sampling : str, optional
+        'stratified' or 'random' sampling of the stacking sequences averaged in a stage, see sampleSequences, by default
+        'stratified'
+    commonRandom : bool, optional
+        Set to True to sample the stacking sequences of all candidates in a stage from the same random draws (common random
+        numbers), so faults are nested as the probability increases and R^2 varies smoothly between neighbouring candidates,
+        by default False
+    seed : int, optional
+        Random number generator seed, by default None
+    precision : str, optional
+        'double' or 'single' precision of simulated patterns, by default 'double'
+    report : str, optional
+        File path to write a text report of the compute spent in each stage to, by default None
+
+    Returns
+    -------
+    results : list
+        Fault probability, stacking vector and R^2 value of each candidate that reached the final stage, best first
+    costs : list
+        Number of candidates, structure factor cost (reflections x stacks x sequences) and wall time in seconds of each stage,
+        followed by the estimated cost and wall time of a full fidelity sweep of all candidates
+    """
+    from pyfaults.scattering_functions import IncrementalPattern
+    from pyfaults.structure_functions import sampleSequences
+
+    rng = np.random.default_rng(seed)
+    exptQ = np.asarray(exptQ, dtype=float)
+    exptInts = np.asarray(exptInts, dtype=float)
+
+    if ladder is None:
+        ladder = [[10, 0.02, 1], [100, None, 1]]
+    if np.ndim(keep) == 0:
+        keep = [keep] * (len(ladder) - 1)
+    if len(keep) != len(ladder) - 1:
+        raise ValueError('keep must give one fraction per promotion ({0}), got {1}'.format(len(ladder) - 1, len(keep)))
+
+    candidates = [[p, np.asarray(s, dtype=float)] for p in probList for s in sVecList]
+    costs = []
+
+    for stage, (nStacks, qStep, nReal) in enumerate(ladder):
+        start = time.perf_counter()
+        if qStep is None:
+            stageQ, stageInts = exptQ, exptInts
+        else:
+            stageQ = np.arange(exptQ[0], exptQ[-1], qStep)
+            stageInts = np.interp(stageQ, exptQ, exptInts)
+
+        # one pattern per stage; candidates only move the stacks whose displacement changes
+        ip = IncrementalPattern(unitcell, nStacks, fltLayer, candidates[0][1], wl, maxTT, precision=precision)
+        scores = []
+        cost = 0
+        stageSeed = rng.integers(2**32)
+        for p, s in candidates:
+            ints = 0
+            sequences, weights = sampleSequences(nStacks, p, nReal, sampling=sampling, seed=stageSeed if commonRandom else rng)
+            for seq, weight in zip(sequences, weights):
+                shifts = np.outer(seq, s)
+                for n in np.flatnonzero(np.any(shifts != ip.shifts, axis=1)):
+                    ip.setStack(n, shifts[n])
+                q, pattern = ip.pattern(pw=pw, qStep=qStep)
+                ints = ints + weight*pattern
+            scores.append(_scaledR2(q, ints, stageQ, stageInts))
+            cost = cost + len(ip.hkl) * nStacks * nReal
+        costs.append([len(candidates), cost, time.perf_counter() - start])
+
+        order = np.argsort(scores)[::-1]
+        if stage < len(ladder) - 1:
+            nKeep = max(1, int(np.ceil(keep[stage] * len(candidates))))
+            candidates = [candidates[i] for i in order[:nKeep]]
+        else:
+            results = [[candidates[i][0], candidates[i][1], scores[i]] for i in order]
+
+    # full fidelity sweep estimated from the per-candidate cost of the final stage
+    nAll = costs[0][0]
+    costs.append([nAll, costs[-1][1] / costs[-1][0] * nAll, costs[-1][2] / costs[-1][0] * nAll])
+
+    if report is not None:
+        spent = sum(c[1] for c in costs[:-1])
+        spentTime = sum(c[2] for c in costs[:-1])
+        with open(report, 'w') as x:
+            x.write('stage nStacks qStep nReal candidates cost seconds\n')
+            for i, ((nStacks, qStep, nReal), (n, cost, t)) in enumerate(zip(ladder, costs)):
+                x.write('{0} {1} {2} {3} {4} {5} {6:.3f}\n'.format(i+1, nStacks, qStep, nReal, n, cost, t))
+            x.write('total - - - {0} {1} {2:.3f}\n'.format(nAll, spent, spentTime))
+            x.write('full - - - {0} {1:.0f} {2:.3f}\n'.format(nAll, costs[-1][1], costs[-1][2]))
+            x.write('saving {0:.1f}x\n'.format(costs[-1][1] / spent))
+
+    return results, costs
+
+
+
+def _rmcStart(start, nStacks, fltLayer, stackVec):
+    """
+    Converts a starting sequence given to rmcFit into per-stack displacement vectors
+    """
+    shifts = np.zeros((nStacks, 3))
+    if start is None:
+        return shifts
+
+    if isinstance(start, str):
+        return np.load(start)['shifts']
+
+    if hasattr(start, 'sequence'):
+        start = start.sequence
+
+    start = np.asarray(start)
+    if start.ndim == 1 and len(start) == nStacks:
+        shifts[start != 0] = stackVec
+        return shifts
+    if start.ndim == 2 and start.shape[0] == nStacks and start.shape[1] in (2, 3):
+        shifts[:, :start.shape[1]] = start
+        return shifts
+    raise ValueError('start must be a sequence of {0} stacks or an array of {0} displacement vectors'.format(nStacks))
+
+
+
+def _rmcScore(ip, exptQ, exptInts, pw):
+    """
+    R^2 value of the current pattern of an IncrementalPattern against experimental data, using the least-squares scale factor
+    """
+    q, ints = ip.pattern(pw=pw)
+    return _scaledR2(q, ints, exptQ, exptInts)
+
+
+
+def _scaledR2(q, ints, exptQ, exptInts):
+    """
+    R^2 value of a simulated pattern interpolated onto experimental Q values, using the least-squares scale factor
+    """
+    sim = np.interp(exptQ, q, ints.astype(float))
+    scale = np.dot(sim, exptInts) / np.dot(sim, sim)
+    res = exptInts - scale*sim
+    dev = exptInts - np.mean(exptInts)
+    return 1 - np.dot(res, res) / np.dot(dev, dev)
+
+
+
+def _windowMask(q, windows):
+    """
+    Converts Q windows or a boolean mask over Q values into a boolean mask
+    """
+    from pyfaults.scattering_functions import inWindows
+
+    windows = np.asarray(windows)
+    if windows.dtype == bool:
+        return windows
+    return inWindows(q, windows)
@@ -0,0 +1,461 @@
+"""
+engine_functions.py
+
+Module containing the registry of PXRD simulation engines; every engine takes a CIF and instrument parameters and returns Q and
+intensity values, so fullSim, simulate and the GUI can select one by name
+
+registerEngine --> adds a simulation engine to the registry
+getEngine --> looks up a registered simulation engine by name
+findEngine --> picks the fastest registered engine that has a set of capabilities
+readCif --> loads the atoms and lattice of a CIF into arrays
+loadCrystal --> loads a CIF as a Dans_Diffraction Crystal
+dansEngine --> simulates a PXRD pattern with Dans_Diffraction
+nativeEngine --> simulates a PXRD pattern with the native reciprocal-space engine
+debyeEngine --> simulates a PXRD pattern of a finite crystallite with the Debye scattering equation
+
+----------
+ENGINES
+Engine functions have the signature engine(path, cif, wl, tt_max, *, pw=0.0, bg=0, **options) --> q, ints, where path is a
+directory or a RunArchive (export_functions) and CIFs are loaded with readCif or loadCrystal. Capabilities are plain strings:
+    periodic --> Bragg scattering of an infinite periodic crystal
+    finiteSize --> scattering of a finite crystallite, including size broadening and diffuse scattering
+    peakWidth --> applies the artificial peak broadening term pw
+    background --> adds normal instrument background bg
+    precision --> accepts precision='single'
+    windows --> accepts Q windows to restrict the simulation to
+    memLimit --> accepts a memory budget in bytes for its intermediates
+Engine options beyond pw and bg are passed by fullSim and simulate as an engineOptions dictionary. An 'auto' engine must have
+the capabilities requested with require, plus those named by optionCapabilities that appear among the engine options; other
+options, such as size of the debye engine, are passed on without restricting the choice
+"""
+
+#---------- import packages ----------
+import Dans_Diffraction as df
+import numpy as np
+import gzip, os, re, tempfile
+
+
+
+# registered engines by name, each a dictionary with keys 'function', 'speed' and 'capabilities'
+engines = {}
+
+# capabilities that are also engine options, so an engine given one of these options must have the capability
+optionCapabilities = ('precision', 'windows', 'memLimit')
+
+# exact header written by structure_functions.writeCif, capturing the six lattice parameters
+pfCifHeader = re.compile(
+    r"_symmetry_space_group_name_H-M\s+P1\s+_symmetry_Int_Tables_number\s+1\s+_symmetry_cell_setting\s+triclinic\s+"
+    r"_cell_length_a\s+(\S+)\s+_cell_length_b\s+(\S+)\s+_cell_length_c\s+(\S+)\s+"
+    r"_cell_angle_alpha\s+(\S+)\s+_cell_angle_beta\s+(\S+)\s+_cell_angle_gamma\s+(\S+)\s+"
+    r"loop_\s+_space_group_symop_operation_xyz\s+'x, y, z'\s+"
+    r"loop_\s+_atom_site_label\s+_atom_site_type_symbol\s+_atom_site_fract_x\s+_atom_site_fract_y\s+_atom_site_fract_z\s+"
+    r"_atom_site_B_iso_or_equiv\s+_atom_site_adp_type\s+_atom_site_occupancy\s*\n")
+
+
+
+#-------------------------------------
+#----- FUNCTION: registerEngine ------
+#-------------------------------------
+def registerEngine(name, function, speed, capabilities):
+    """
+    Adds a simulation engine to the registry, replacing any engine of the same name
+
+    Parameters
+    ----------
+    name : str
+        Name used to select the engine
+    function : function
+        Engine function with the signature engine(path, cif, wl, tt_max, *, pw=0.0, bg=0, **options) --> q, ints
+    speed : int
+        Speed rank of the engine, lower is faster; used by findEngine
+    capabilities : list of str
+        Capabilities of the engine, see module docstring
+    """
+    engines[name] = {'function': function, 'speed': speed, 'capabilities': set(capabilities)}
+
+
+
+#-------------------------------------
+#-------- FUNCTION: getEngine --------
+#-------------------------------------
+def getEngine(name):
+    """
+    Looks up a registered simulation engine by name
+
+    Parameters
+    ----------
+    name : str
+        Name of engine
+
+    Returns
+    -------
+    function : function
+        Engine function
+    """
+    if name not in engines:
+        raise ValueError('unknown engine {0!r}, expected one of {1}'.format(name, sorted(engines)))
+    return engines[name]['function']
+
+
+
+#-------------------------------------
+#------- FUNCTION: findEngine --------
+#-------------------------------------
+def findEngine(*capabilities):
+    """
+    Picks the fastest registered engine that has a set of capabilities
+
+    Parameters
+    ----------
+    *capabilities : str
+        Required capabilities, see module docstring
+
+    Returns
+    -------
+    name : str
+        Name of engine
+    """
+    valid = [name for name in engines if engines[name]['capabilities'].issuperset(capabilities)]
+    if not valid:
+        raise ValueError('no registered engine has capabilities {0}'.format(sorted(capabilities)))
+    return min(valid, key=lambda name: engines[name]['speed'])
+
+
+
+#-------------------------------------
+#--------- FUNCTION: readCif ---------
+#-------------------------------------
+def readCif(path, cif):
+    """
+    Loads the atoms and lattice of a CIF into arrays; CIFs written by pyfaults (toCif, writeCif) are read directly with a
+    vectorized parser, any other CIF is parsed with Dans_Diffraction. A 100k atom CIF written by pyfaults is read in ~0.13 s
+    (~0.2 s into a Crystal with loadCrystal) against ~2.4 s with Dans_Diffraction; most of the remaining time is splitting the
+    text into tokens
+
+    Parameters
+    ----------
+    path : str or RunArchive
+        File path to directory where CIF is stored, or run archive (export_functions) holding it
+    cif : str
+        Name of CIF, read from <cif>.cif or else <cif>.cif.gz, or tag of the CIF in a run archive
+
+    Returns
+    -------
+    xyz : nparray
+        Fractional atomic positions with shape (atoms, 3)
+    elements : nparray
+        Element of each atom
+    occ : nparray
+        Site occupancy of each atom
+    biso : nparray
+        Isotropic atomic displacement parameter of each atom in square Angstroms
+    lattice : Lattice
+        Lattice parameters
+    """
+    from pyfaults.structure_classes import Lattice
+
+    text, fileName = _readCifText(path, cif)
+    pfCif = _parsePfCif(text)
+    if pfCif is not None:
+        xyz, elements, labels, occ, biso, lp = pfCif
+        return xyz, elements, occ, biso, Lattice(*lp)
+
+    struct = _dansCrystal(text, fileName)
+    xyz, elements, label, occ, uiso, mxmymz = struct.Structure.get()
+    lattice = Lattice(*struct.Cell.lp())
+    return np.asarray(xyz, dtype=float), elements, occ, uiso * 8*np.pi**2, lattice
+
+
+
+def _readCifText(path, cif):
+    """
+    Returns the text of a plain, gzip-compressed or archived CIF, and its file name (None for archive members)
+    """
+    if not isinstance(path, str):
+        return path.read(path.cifMember(cif)), None
+
+    fileName = path + cif + '.cif'
+    if not os.path.exists(fileName) and os.path.exists(fileName + '.gz'):
+        fileName += '.gz'
+    opener = gzip.open if fileName.endswith('.gz') else open
+    with opener(fileName, 'rt') as f:
+        return f.read(), fileName
+
+
+
+def _parsePfCif(text):
+    """
+    Parses a CIF with the exact layout written by pyfaults into arrays (xyz, elements, labels, occ, biso, lattice parameters),
+    or returns None for any other CIF; raises ValueError for type symbols that do not name an element
+    """
+    header = pfCifHeader.match(text)
+    if header is None:
+        return None
+    tokens = text[header.end():].split()
+    if len(tokens) % 8 or any(adp != 'Biso' for adp in set(tokens[6::8])):
+        return None
+
+    try:
+        lp = [float(v) for v in header.groups()]
+        xyz = np.column_stack([np.array(tokens[i::8], dtype=float) for i in (2, 3, 4)])
+        biso = np.array(tokens[5::8], dtype=float)
+        occ = np.array(tokens[7::8], dtype=float)
+    except ValueError:
+        return None
+
+    # element symbols without charges, as Dans_Diffraction reads them
+    symbols = {sym: df.fc.str2element(sym) for sym in set(tokens[1::8])}
+    unknown = sorted(sym for sym, element in symbols.items() if not element)
+    if unknown:
+        raise ValueError('unknown element type symbols in CIF: {0}'.format(', '.join(unknown)))
+    elements = np.array([symbols[sym] for sym in tokens[1::8]])
+    labels = np.array(tokens[0::8])
+
+    return xyz.reshape(-1, 3), elements, labels, occ, biso, lp
+
+
+
+def _dansCrystal(text, fileName):
+    """
+    Parses a CIF with Dans_Diffraction, through a temporary file if it is compressed or archived
+    """
+    if fileName is not None and not fileName.endswith('.gz'):
+        return df.Crystal(fileName)
+
+    with tempfile.NamedTemporaryFile('w', suffix='.cif', delete=False) as f:
+        f.write(text)
+    try:
+        return df.Crystal(f.name)
+    finally:
+        os.remove(f.name)
+
+
+
+#-------------------------------------
+#------- FUNCTION: loadCrystal -------
+#-------------------------------------
+def loadCrystal(path, cif):
+    """
+    Loads a CIF as a Dans_Diffraction Crystal; for CIFs written by pyfaults the Crystal is filled from the arrays of the
+    vectorized parser instead of being parsed again by Dans_Diffraction
+
+    Parameters
+    ----------
+    path : str or RunArchive
+        File path to directory where CIF is stored, or run archive (export_functions) holding it
+    cif : str
+        Name of CIF, read from <cif>.cif or else <cif>.cif.gz, or tag of the CIF in a run archive
+
+    Returns
+    -------
+    struct : Crystal
+        Dans_Diffraction crystal structure
+    """
+    text, fileName = _readCifText(path, cif)
+    pfCif = _parsePfCif(text)
+    if pfCif is None:
+        return _dansCrystal(text, fileName)
+
+    xyz, elements, labels, occ, biso, lp = pfCif
+    struct = df.Crystal()
+    struct.name = cif
+    struct.new_cell(lp)
+    struct.new_atoms(u=xyz[:,0], v=xyz[:,1], w=xyz[:,2], type=elements, label=labels, occupancy=occ,
+                     uiso=df.fc.biso2uiso(biso))
+    return struct
+
+
+
+#-------------------------------------
+#-------- FUNCTION: dansEngine -------
+#-------------------------------------
+def dansEngine(path, cif, wl, tt_max, *, pw=0.0, bg=0):
+    """
+    Simulates a PXRD pattern from a CIF with Dans_Diffraction
+
+    Parameters
+    ----------
+    path : str or RunArchive
+        File path to directory where CIF is stored, or run archive (export_functions) holding it
+    cif : str
+        Name of CIF
+    wl : float
+        Simulated instrument wavelength in units of Angstroms
+    tt_max : float
+        Maximum 2theta in units of degrees
+    pw : float, optional
+        Artificial peak broadening term, by default 0.0
+    bg : float, optional
+        Average of normal instrument background, by default 0
+
+    Returns
+    -------
+    q : nparray
+        Diffraction pattern Q values in units of inverse Angstroms
+    ints : nparray
+        Diffraction pattern intensity values
+    """
+    # load CIF as crystal structure readable by Dans_Diffraction
+    struct = loadCrystal(path, cif)
+
+    # calculate energy in keV from wavelength
+    energy_kev = df.fc.wave2energy(wl)
+    # set scattering source type to X-rays
+    struct.Scatter.setup_scatter('xray')
+    # calculate maximum wavevector from maximum 2theta and energy
+    wavevector_max = df.fc.calqmag(tt_max, energy_kev)
+
+    # calculate PXRD pattern
+    return struct.Scatter.generate_powder(wavevector_max, peak_width=pw, background=bg, powder_average=True)
+
+
+
+#-------------------------------------
+#------- FUNCTION: nativeEngine ------
+#-------------------------------------
+def nativeEngine(path, cif, wl, tt_max, *, pw=0.0, bg=0, windows=None, precision='double', memLimit=None):
+    """
+    Simulates a PXRD pattern from a CIF with the native reciprocal-space engine (scattering_functions)
+
+    Parameters
+    ----------
+    path : str or RunArchive
+        File path to directory where CIF is stored, or run archive (export_functions) holding it
+    cif : str
+        Name of CIF
+    wl : float
+        Simulated instrument wavelength in units of Angstroms
+    tt_max : float
+        Maximum 2theta in units of degrees
+    pw : float, optional
+        Artificial peak broadening term, by default 0.0
+    bg : float, optional
+        Average of normal instrument background, by default 0
+    windows : list of nparray, optional
+        Q windows formatted as [[qMin, qMax], ...] to restrict the pattern to, by default None (full Q range)
+    precision : str, optional
+        'double' or 'single', by default 'double'
+    memLimit : int, optional
+        Memory budget in bytes for the intermediates of one structure factor tile, by default None
+
+    Returns
+    -------
+    q : nparray
+        Diffraction pattern Q values in units of inverse Angstroms
+    ints : nparray
+        Diffraction pattern intensity values
+    """
+    from pyfaults.XRD_functions import batchPattern
+
+    xyz, elements, occ, biso, lattice = readCif(path, cif)
+    q, ints = batchPattern(xyz[np.newaxis], elements, occ, biso, lattice, wl, tt_max, pw=pw, bg=bg, windows=windows,
+                           precision=precision, memLimit=memLimit)
+    return q, ints[0]
+
+
+
+#-------------------------------------
+#------- FUNCTION: debyeEngine -------
+#-------------------------------------
+def debyeEngine(path, cif, wl, tt_max, *, pw=0.0, bg=0, size=50.0, dr=0.005, memLimit=None):
+    """
+    Simulates a PXRD pattern of a finite crystallite built by repeating the cell of a CIF, with the Debye scattering equation
+    I(Q) = sum_ij f_i f_j sin(Q r_ij) / (Q r_ij); interatomic distances are histogrammed per pair of atom types, so the cost
+    scales with the square of the number of atoms in the crystallite
+
+    Parameters
+    ----------
+    path : str or RunArchive
+        File path to directory where CIF is stored, or run archive (export_functions) holding it
+    cif : str
+        Name of CIF
+    wl : float
+        Simulated instrument wavelength in units of Angstroms
+    tt_max : float
+        Maximum 2theta in units of degrees
+    pw : float, optional
+        Not supported, peak widths follow from the crystallite size; must be 0.0, by default 0.0
+    bg : float, optional
+        Average of normal instrument background, by default 0
+    size : float, optional
+        Minimum edge length of the crystallite along each lattice vector in Angstroms, by default 50.0
+    dr : float, optional
+        Distance histogram bin width in Angstroms, by default 0.005
+    memLimit : int, optional
+        Memory budget in bytes for one block of pair distances or sinc terms, by default None (defaultMemLimit)
+
+    Returns
+    -------
+    q : nparray
+        Diffraction pattern Q values in units of inverse Angstroms
+    ints : nparray
+        Diffraction pattern intensity values
+    """
+    from pyfaults.XRD_functions import tt_to_q
+    from pyfaults.scattering_functions import formFactors, defaultMemLimit
+
+    if pw:
+        raise ValueError('the debye engine does not support the peak broadening term pw, set the crystallite size instead')
+    if memLimit is None:
+        memLimit = defaultMemLimit
+
+    xyz, elements, occ, biso, lattice = readCif(path, cif)
+
+    # atom types share form factor and Debye-Waller factor
+    elemNames, elemIndex = np.unique(np.asarray(elements, dtype=str), return_inverse=True)
+    types, typeIndex = np.unique(np.column_stack([elemIndex, biso]), axis=0, return_inverse=True)
+    nTypes = len(types)
+
+    # crystallite of whole cells
+    reps = np.ceil(size / np.array([lattice.a, lattice.b, lattice.c])).astype(int)
+    cells = np.stack(np.meshgrid(*[np.arange(n) for n in reps], indexing='ij'), axis=-1).reshape(-1, 1, 3)
+    pos = lattice.toCartesian(xyz[np.newaxis] + cells).reshape(-1, 3)
+    typeIndex = np.tile(typeIndex.ravel(), len(cells))
+    weight = np.tile(np.asarray(occ, dtype=float), len(cells))
+    nAtoms = len(pos)
+
+    # distance histogram of each ordered pair of atom types, block by block over the upper triangle of atom pairs
+    nBins = int(np.linalg.norm(pos.max(axis=0) - pos.min(axis=0)) / dr) + 2
+    hist = np.zeros(nTypes * nTypes * nBins)
+    # peak bytes per atom pair of a block, measured at 64: the 24 B coordinate differences and the temporaries of their norm,
+    # the distance, type pair and weight matrices with their upper-triangle copies, and the 1 B mask; rounded up for headroom
+    pairBytes = 72
+    block = max(1, memLimit // (pairBytes * nAtoms))
+    for i0 in range(0, nAtoms, block):
+        i1 = min(i0 + block, nAtoms)
+        upper = np.arange(i0, i1)[:, np.newaxis] < np.arange(i0, nAtoms)
+        d = np.linalg.norm(pos[i0:i1, np.newaxis] - pos[np.newaxis, i0:], axis=-1)[upper]
+        pair = (typeIndex[i0:i1, np.newaxis] * nTypes + typeIndex[np.newaxis, i0:])[upper]
+        w = (weight[i0:i1, np.newaxis] * weight[np.newaxis, i0:])[upper]
+        hist += np.bincount(pair * nBins + np.rint(d / dr).astype(int), weights=w, minlength=len(hist))
+    hist = hist.reshape(nTypes * nTypes, nBins)
+    used = hist.any(axis=0)
+    r, hist = np.arange(nBins)[used] * dr, hist[:, used]
+
+    # same Q grid as the reciprocal-space engines
+    qMax = tt_to_q(tt_max, wl)
+    q = np.linspace(0, qMax, int(2000*qMax))
+    ff = formFactors(elemNames, q)[:, types[:,0].astype(int)] * np.exp(-np.outer((q / (4*np.pi))**2, types[:,1]))
+    ffPair = (ff[:, :, np.newaxis] * ff[:, np.newaxis, :]).reshape(len(q), -1)
+
+    # self terms plus twice each distinct pair
+    ints = (ff**2) @ np.bincount(typeIndex, weights=weight**2, minlength=nTypes)
+    # peak bytes per Q x distance element of a block, measured at 32: the outer product, its scaled copy and the temporaries of
+    # np.sinc
+    qBlock = max(1, memLimit // (40 * max(1, len(r))))
+    for q0 in range(0, len(q), qBlock):
+        q1 = min(q0 + qBlock, len(q))
+        sinc = np.sinc(np.outer(q[q0:q1], r) / np.pi)
+        ints[q0:q1] += 2 * np.sum(ffPair[q0:q1] * (sinc @ hist.T), axis=1)
+
+    if bg:
+        ints = ints + np.random.normal(bg, np.sqrt(bg), ints.shape)
+
+    return q, ints
+
+
+
+# built-in engines
+registerEngine('native', nativeEngine, 1, ['periodic', 'peakWidth', 'background', 'precision', 'windows', 'memLimit'])
+registerEngine('dans', dansEngine, 2, ['periodic', 'peakWidth', 'background'])
+registerEngine('debye', debyeEngine, 3, ['finiteSize', 'background', 'memLimit'])
@@ -0,0 +1,291 @@
+"""
+export_functions.py
+
+Module containing the export layer for CIFs and simulated patterns: a background writer that moves file exports off the
+compute thread, so file system latency overlaps with structure generation and simulation, and a run archive that collects all
+exports of a run in a single zip file
+
+BackgroundWriter --> A bounded pool of writer threads that exports files in the background
+RunArchive --> A zip archive holding the CIFs and simulated patterns of a run, with random access to members
+writePattern --> exports Q and intensity values of a PXRD pattern to a text file or archive member
+
+----------
+RUN ARCHIVES
+Functions that take a directory path for CIFs or patterns (toCif, genSupercells, readCif, loadCrystal, the simulation engines,
+fullSim, importFile) also accept a RunArchive in its place; members are then addressed by tag:
+    supercells/<tag>.cif --> CIF of a supercell
+    supercells/duplicates.txt --> tags of duplicate supercells and the tag of their exported structure, see genSupercells
+    simulations/<tag>_sim.txt --> simulated pattern of a supercell
+The zip central directory indexes all members, so single members are read without unpacking the archive
+"""
+
+#---------- import packages ----------
+from concurrent.futures import ThreadPoolExecutor
+import contextlib, io, threading, zipfile
+
+
+
+#-------------------------------------
+#------ CLASS: BackgroundWriter ------
+#-------------------------------------
+class BackgroundWriter(object):
+
+    #---------- properties ----------
+    nThreads = property(lambda self: self._nThreads, doc='int : Number of writer threads')
+
+    maxPending = property(lambda self: self._maxPending,
+                          doc='int : Maximum number of queued or running writes before submit blocks (back-pressure)')
+
+    pending = property(lambda self: len(self._futures), doc='int : Number of writes submitted since the last flush')
+
+    #---------- functions ----------
+    def __init__(self, nThreads=4, maxPending=16):
+        """
+        Initializes a new BackgroundWriter; use as a context manager, or call close when done, so every write is finished and
+        any error is raised
+
+        Parameters
+        ----------
+        nThreads : int, optional
+            Number of writer threads, by default 4
+        maxPending : int, optional
+            Maximum number of queued or running writes; submit blocks until a slot is free, so memory held by queued exports
+            stays bounded, by default 16
+        """
+        if nThreads < 1 or maxPending < 1:
+            raise ValueError('nThreads and maxPending must be at least 1')
+
+        self._nThreads = nThreads
+        self._maxPending = maxPending
+        self._slots = threading.BoundedSemaphore(maxPending)
+        self._pool = ThreadPoolExecutor(max_workers=nThreads, thread_name_prefix='pyfaults-export')
+        self._futures = []
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        # finish queued writes; an error in the body of the with statement takes precedence over write errors
+        try:
+            self.close()
+        except Exception:
+            if excType is None:
+                raise
+        return False
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queues function(*args, **kwargs) on a writer thread, blocking while maxPending writes are queued or running; an error
+        from an earlier write is raised here instead of queueing more work
+
+        Parameters
+        ----------
+        function : function
+            Export function, e.g. structure_functions.writeCif or writePattern
+        *args, **kwargs
+            Arguments of function; must not be modified until the write is finished
+        """
+        self._raiseFailed()
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(function, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        self._futures.append(future)
+        return
+
+    def flush(self):
+        """
+        Waits for all submitted writes in submission order and raises the error of the earliest failed write, if any
+        """
+        futures, self._futures = self._futures, []
+        error = None
+        for future in futures:
+            exc = future.exception()
+            if exc is not None and error is None:
+                error = exc
+        if error is not None:
+            raise error
+        return
+
+    def close(self):
+        """
+        Flushes all submitted writes and stops the writer threads
+        """
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown(wait=True)
+        return
+
+    def _raiseFailed(self):
+        """
+        Raises the error of the earliest finished write that failed, after waiting for the rest of the queue
+        """
+        if any(f.done() and f.exception() is not None for f in self._futures):
+            self.flush()
+        return
+
+
+
+#-------------------------------------
+#--------- CLASS: RunArchive ---------
+#-------------------------------------
+class RunArchive(object):
+
+    #---------- properties ----------
+    fileName = property(lambda self: self._fileName, doc='str : File path of zip archive')
+
+    mode = property(lambda self: self._mode, doc="str : 'r' to read, 'w' to create or 'a' to add members")
+
+    #---------- functions ----------
+    def __init__(self, fileName, mode='r', *, compress=False):
+        """
+        Opens a run archive; use as a context manager, or call close when done, so the zip central directory is written
+
+        Parameters
+        ----------
+        fileName : str
+            File path of zip archive
+        mode : str, optional
+            'r' to read, 'w' to create (replacing an existing archive) or 'a' to add members, by default 'r'
+        compress : bool, optional
+            Set to True to deflate members written to the archive, by default False (stored)
+        """
+        if mode not in ('r', 'w', 'a'):
+            raise ValueError("mode must be 'r', 'w' or 'a'")
+
+        self._fileName = fileName
+        self._mode = mode
+        self._zip = zipfile.ZipFile(fileName, mode, compression=zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+        # zip files allow a single open member at a time, shared by reading and writing threads
+        self._lock = threading.RLock()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
+
+    def cifMember(self, tag):
+        """
+        Returns the member name of the CIF of a supercell
+        """
+        return 'supercells/' + tag + '.cif'
+
+    def patternMember(self, tag):
+        """
+        Returns the member name of the simulated pattern of a supercell
+        """
+        return 'simulations/' + tag + '_sim.txt'
+
+    def tags(self, kind='cif'):
+        """
+        Lists the tags of all CIFs (kind='cif') or simulated patterns (kind='pattern') in the archive, in archive order
+
+        Parameters
+        ----------
+        kind : str, optional
+            'cif' or 'pattern', by default 'cif'
+
+        Returns
+        -------
+        tags : list of str
+            Tags of members
+        """
+        prefix, suffix = {'cif': ('supercells/', '.cif'), 'pattern': ('simulations/', '_sim.txt')}[kind]
+        with self._lock:
+            names = self._zip.namelist()
+        found = [name[len(prefix):-len(suffix)] for name in names if name.startswith(prefix) and name.endswith(suffix)]
+        return list(dict.fromkeys(found))
+
+    def exists(self, member):
+        """
+        Returns True if the archive contains a member
+        """
+        with self._lock:
+            try:
+                self._zip.getinfo(member)
+            except KeyError:
+                return False
+        return True
+
+    @contextlib.contextmanager
+    def open(self, member, mode='r'):
+        """
+        Opens a member as a text stream for reading ('r') or writing ('w'); other threads wait until the stream is closed.
+        Members cannot be replaced, so writing a member that already exists raises ValueError; write a new archive instead
+
+        Parameters
+        ----------
+        member : str
+            Member name
+        mode : str, optional
+            'r' or 'w', by default 'r'
+        """
+        with self._lock:
+            if mode == 'w' and self.exists(member):
+                raise ValueError('archive {0} already contains {1}'.format(self._fileName, member))
+            with self._zip.open(member, mode) as raw:
+                stream = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+                try:
+                    yield stream
+                finally:
+                    stream.flush()
+                    stream.detach()
+
+    def read(self, member):
+        """
+        Returns the text of a member
+        """
+        with self.open(member) as stream:
+            return stream.read()
+
+    def write(self, member, text):
+        """
+        Writes text to a member
+        """
+        with self.open(member, 'w') as stream:
+            stream.write(text)
+        return
+
+    def close(self):
+        """
+        Writes the zip central directory and closes the archive
+        """
+        with self._lock:
+            self._zip.close()
+        return
+
+
+
+#-------------------------------------
+#------- FUNCTION: writePattern ------
+#-------------------------------------
+def writePattern(fileName, q, ints, *, archive=None):
+    """
+    Exports Q and intensity values of a PXRD pattern to a text file, one 'q ints' pair per line
+
+    Parameters
+    ----------
+    fileName : str
+        File path of text file, or member name if archive is given
+    q : nparray
+        Diffraction pattern Q values in units of inverse Angstroms
+    ints : nparray
+        Diffraction pattern intensity values
+    archive : RunArchive, optional
+        Archive to write the pattern to, by default None
+    """
+    text = ''.join(map('{0} {1}\n'.format, list(q), list(ints)))
+    if archive is not None:
+        archive.write(fileName, text)
+    else:
+        with open(fileName, 'w') as f:
+            f.write(text)
+    return
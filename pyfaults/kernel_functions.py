@@ -0,0 +1,509 @@
+"""
+kernel_functions.py
+
+Module containing array kernels for the per-element loops of supercell generation and PXRD analysis; each kernel is compiled
+with Numba when it is installed (pip install pyfaults[fast]) and otherwise falls back to an equivalent NumPy implementation
+
+stackPositions --> calculates atomic positions of a layer placed in a given stack of a supercell
+countFaults --> counts stacks whose assigned probability value falls at or below a threshold
+maxIndex --> finds the maximum intensity value and its index
+normalizeWindow --> normalizes intensities to their maximum within a Q window
+matchQ --> finds all pairs of points in two datasets with equal Q after rounding
+walkSequence --> walks a Markov chain of layer states from a cumulative transition probability matrix
+walkSequences --> walks many independent Markov chains of layer states from one or a stack of cumulative transition probability
+    matrices
+benchmarkKernels --> times the compiled and fallback implementations of each kernel
+
+----------
+Both implementations of every kernel give identical results; set useNumba = False to force the NumPy fallback
+"""
+
+#---------- import packages ----------
+import numpy as np
+import bisect, time
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# True if Numba is installed
+hasNumba = numba is not None
+# set to False to use the NumPy fallback even when Numba is installed
+useNumba = hasNumba
+
+
+
+def _jit(func):
+    """
+    Compiles a loop kernel with Numba, or returns None when Numba is not installed
+    """
+    if numba is None:
+        return None
+    return numba.njit(cache=True, nogil=True, error_model='numpy')(func)
+
+def _compiled(kernel):
+    """
+    Returns True if the compiled version of a kernel should be used
+    """
+    return useNumba and kernel is not None
+
+
+
+#-------------------------------------
+#----- FUNCTION: stackPositions ------
+#-------------------------------------
+def _stackPositionsLoop(xyz, nCurrent, nStacks, zAdj, stackVec, isFaulted):
+    out = np.empty_like(xyz)
+    for i in range(xyz.shape[0]):
+        if isFaulted:
+            out[i, 0] = xyz[i, 0] + stackVec[0]
+            out[i, 1] = xyz[i, 1] + stackVec[1]
+            out[i, 2] = (xyz[i, 2] + nCurrent + zAdj) / nStacks + stackVec[2]
+        else:
+            out[i, 0] = xyz[i, 0]
+            out[i, 1] = xyz[i, 1]
+            out[i, 2] = (xyz[i, 2] + nCurrent) / nStacks
+    return out
+
+_stackPositionsJit = _jit(_stackPositionsLoop)
+
+def stackPositions(xyz, nCurrent, nStacks, zAdj, stackVec, isFaulted):
+    """
+    Calculates atomic positions of a layer placed in a given stack of a supercell
+
+    Parameters
+    ----------
+    xyz : nparray
+        Fractional atomic positions in the unit cell with shape (atoms, 3)
+    nCurrent : int
+        Number of current stack in supercell, starting from 0
+    nStacks : int
+        Number of unit cells stacked to generate supercell
+    zAdj : float
+        Out-of-plane displacement vector component (z)
+    stackVec : nparray
+        Displacement vector [x,y,z] or [x,y] applied to faulted stacks
+    isFaulted : bool
+        Set to True if current stack is faulted, set to False if not faulted
+
+    Returns
+    -------
+    newXYZ : nparray
+        Fractional atomic positions in the supercell
+    """
+    xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+    stackVec = np.asarray(stackVec, dtype=float).ravel()
+    if len(stackVec) == 2:
+        stackVec = np.append(stackVec, 0.0)
+    if _compiled(_stackPositionsJit):
+        return _stackPositionsJit(xyz, nCurrent, nStacks, float(zAdj), stackVec, bool(isFaulted))
+
+    newXYZ = xyz.copy()
+    if isFaulted:
+        newXYZ[:,2] = (xyz[:,2] + nCurrent + zAdj) / nStacks
+        newXYZ = newXYZ + stackVec
+    else:
+        newXYZ[:,2] = (xyz[:,2] + nCurrent) / nStacks
+    return newXYZ
+
+
+
+#-------------------------------------
+#------- FUNCTION: countFaults -------
+#-------------------------------------
+def _countFaultsLoop(assignProb, threshold):
+    count = 0
+    for i in range(assignProb.shape[0]):
+        if assignProb[i] <= threshold:
+            count += 1
+    return count
+
+_countFaultsJit = _jit(_countFaultsLoop)
+
+def countFaults(assignProb, threshold):
+    """
+    Counts stacks whose assigned probability value falls at or below a threshold
+
+    Parameters
+    ----------
+    assignProb : nparray
+        Randomly generated probability values for each unit cell stack in supercell
+    threshold : float
+        Fault probability in the same units as assignProb
+
+    Returns
+    -------
+    count : int
+        Number of faulted stacks
+    """
+    assignProb = np.asarray(assignProb, dtype=float)
+    if _compiled(_countFaultsJit):
+        return int(_countFaultsJit(assignProb, float(threshold)))
+    return int(np.count_nonzero(assignProb <= threshold))
+
+
+
+#-------------------------------------
+#-------- FUNCTION: maxIndex ---------
+#-------------------------------------
+def _maxIndexLoop(ints):
+    intsMax = 0.0
+    index = 0
+    for i in range(ints.shape[0]):
+        if ints[i] > intsMax:
+            intsMax = ints[i]
+            index = i
+    return intsMax, index
+
+_maxIndexJit = _jit(_maxIndexLoop)
+
+def maxIndex(ints):
+    """
+    Finds the first occurrence of the maximum intensity value; returns zero and index 0 if no value is positive
+
+    Parameters
+    ----------
+    ints : nparray
+        Intensity values
+
+    Returns
+    -------
+    intsMax : float
+        Maximum intensity value
+    index : int
+        Array index corresponding to maximum intensity
+    """
+    ints = np.asarray(ints, dtype=float)
+    if _compiled(_maxIndexJit):
+        intsMax, index = _maxIndexJit(ints)
+        return float(intsMax), int(index)
+
+    if len(ints) == 0:
+        return 0.0, 0
+    index = int(np.argmax(ints))
+    if ints[index] > 0:
+        return float(ints[index]), index
+    return 0.0, 0
+
+
+
+#-------------------------------------
+#----- FUNCTION: normalizeWindow -----
+#-------------------------------------
+def _normalizeWindowLoop(q, ints, qMin, qMax):
+    normMax = 0.0
+    for i in range(q.shape[0]):
+        if q[i] >= qMin and q[i] <= qMax and ints[i] > normMax:
+            normMax = ints[i]
+
+    normInts = np.zeros(ints.shape[0])
+    for i in range(ints.shape[0]):
+        if ints[i] > 0:
+            normInts[i] = ints[i] / normMax
+    return normInts
+
+_normalizeWindowJit = _jit(_normalizeWindowLoop)
+
+def normalizeWindow(q, ints, qMin, qMax):
+    """
+    Normalizes intensities to their maximum within a Q window; non-positive intensities are set to zero
+
+    Parameters
+    ----------
+    q : nparray
+        Q values in inverse Angstroms
+    ints : nparray
+        Intensity values
+    qMin : float
+        Lower bound of Q window
+    qMax : float
+        Upper bound of Q window
+
+    Returns
+    -------
+    normInts : nparray
+        Normalized intensity values
+    """
+    q = np.asarray(q, dtype=float)
+    ints = np.asarray(ints, dtype=float)
+    if _compiled(_normalizeWindowJit):
+        return _normalizeWindowJit(q, ints, float(qMin), float(qMax))
+
+    window = ints[(q >= qMin) & (q <= qMax)]
+    normMax = max(0.0, float(np.max(window))) if len(window) > 0 else 0.0
+
+    normInts = np.zeros(len(ints))
+    pos = ints > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normInts[pos] = ints[pos] / normMax
+    return normInts
+
+
+
+#-------------------------------------
+#---------- FUNCTION: matchQ ---------
+#-------------------------------------
+def _expandRangesLoop(lo, hi):
+    total = 0
+    for i in range(lo.shape[0]):
+        total += hi[i] - lo[i]
+
+    idx1 = np.empty(total, dtype=np.int64)
+    pos = np.empty(total, dtype=np.int64)
+    n = 0
+    for i in range(lo.shape[0]):
+        for j in range(lo[i], hi[i]):
+            idx1[n] = i
+            pos[n] = j
+            n += 1
+    return idx1, pos
+
+_expandRangesJit = _jit(_expandRangesLoop)
+
+def matchQ(q1, q2, *, decimals=3):
+    """
+    Finds all pairs of points in two datasets with equal Q after rounding, ordered by index in dataset 1 and then dataset 2
+
+    Parameters
+    ----------
+    q1 : nparray
+        Dataset 1 Q values in inverse Angstroms
+    q2 : nparray
+        Dataset 2 Q values in inverse Angstroms
+    decimals : int, optional
+        Number of decimal places to round Q values to before matching, by default 3
+
+    Returns
+    -------
+    idx1 : nparray
+        Indices of matched points in dataset 1
+    idx2 : nparray
+        Indices of matched points in dataset 2
+    """
+    key1 = np.rint(np.asarray(q1, dtype=float) * 10**decimals).astype(np.int64)
+    key2 = np.rint(np.asarray(q2, dtype=float) * 10**decimals).astype(np.int64)
+
+    # stable sort keeps dataset 2 in index order within equal keys
+    order = np.argsort(key2, kind='stable')
+    sortKey2 = key2[order]
+    lo = np.searchsorted(sortKey2, key1, side='left').astype(np.int64)
+    hi = np.searchsorted(sortKey2, key1, side='right').astype(np.int64)
+
+    if _compiled(_expandRangesJit):
+        idx1, pos = _expandRangesJit(lo, hi)
+    else:
+        counts = hi - lo
+        idx1 = np.repeat(np.arange(len(key1), dtype=np.int64), counts)
+        pos = np.arange(int(counts.sum()), dtype=np.int64) + np.repeat(lo - (np.cumsum(counts) - counts), counts)
+
+    return idx1, order[pos]
+
+def _matchQLoop(q1, q2, decimals=3):
+    """
+    Original pairwise Q matching loop of r2val and diff_r2, O(len(q1) * len(q2)); the interpreted baseline of matchQ
+    """
+    fmt = '%.' + str(decimals) + 'f'
+    idx1 = []
+    idx2 = []
+    for i in range(len(q1)):
+        q1_val = float(fmt % (q1[i]))
+        for j in range(len(q2)):
+            q2_val = float(fmt % (q2[j]))
+            if q1_val == q2_val:
+                idx1.append(i)
+                idx2.append(j)
+    return np.array(idx1, dtype=np.int64), np.array(idx2, dtype=np.int64)
+
+
+
+#-------------------------------------
+#------- FUNCTION: walkSequence ------
+#-------------------------------------
+def _walkSequenceLoop(start, cumProb, draws):
+    nStates = cumProb.shape[1]
+    seq = np.empty(draws.shape[0] + 1, dtype=np.int64)
+    seq[0] = start
+    for i in range(draws.shape[0]):
+        row = cumProb[seq[i]]
+        nxt = 0
+        while nxt < nStates - 1 and row[nxt] <= draws[i]:
+            nxt += 1
+        seq[i+1] = nxt
+    return seq
+
+_walkSequenceJit = _jit(_walkSequenceLoop)
+
+def walkSequence(start, cumProb, draws):
+    """
+    Walks a Markov chain of layer states; the next state is the first whose cumulative transition probability exceeds the draw
+
+    Parameters
+    ----------
+    start : int
+        Index of starting state
+    cumProb : nparray
+        Cumulative transition probabilities with shape (states, states), row i giving the cumulative sum of P(i -> j)
+    draws : nparray
+        Uniform random numbers in [0, 1), one per transition
+
+    Returns
+    -------
+    seq : nparray
+        Sequence of state indices of length len(draws) + 1
+    """
+    cumProb = np.asarray(cumProb, dtype=float)
+    draws = np.asarray(draws, dtype=float)
+    if _compiled(_walkSequenceJit):
+        return _walkSequenceJit(int(start), cumProb, draws)
+
+    # the chain is sequential, so walk it on Python lists where bisect is cheapest per step
+    last = cumProb.shape[1] - 1
+    rows = cumProb.tolist()
+    seq = [int(start)]
+    for u in draws.tolist():
+        seq.append(min(bisect.bisect_right(rows[seq[-1]], u), last))
+    return np.array(seq, dtype=np.int64)
+
+
+
+#-------------------------------------
+#------ FUNCTION: walkSequences ------
+#-------------------------------------
+def _walkSequencesLoop(start, cumProb, matrix, draws):
+    nStates = cumProb.shape[2]
+    seqs = np.empty((draws.shape[0], draws.shape[1] + 1), dtype=np.int64)
+    for s in range(draws.shape[0]):
+        seqs[s, 0] = start[s]
+        for i in range(draws.shape[1]):
+            row = cumProb[matrix[s], seqs[s, i]]
+            nxt = 0
+            while nxt < nStates - 1 and row[nxt] <= draws[s, i]:
+                nxt += 1
+            seqs[s, i+1] = nxt
+    return seqs
+
+_walkSequencesJit = _jit(_walkSequencesLoop)
+
+def walkSequences(start, cumProb, draws, *, matrix=None):
+    """
+    Walks many independent Markov chains of layer states from one or a stack of cumulative transition probability matrices;
+    same rule as walkSequence, applied to each row of draws
+
+    Parameters
+    ----------
+    start : int or nparray
+        Index of starting state, either shared or one per chain
+    cumProb : nparray
+        Cumulative transition probabilities with shape (states, states), row i giving the cumulative sum of P(i -> j), or a
+        stack of such matrices with shape (matrices, states, states)
+    draws : nparray
+        Uniform random numbers in [0, 1) with shape (chains, transitions)
+    matrix : nparray, optional
+        Index into the stack of cumProb of the matrix of each chain, by default None (every chain uses the first matrix)
+
+    Returns
+    -------
+    seqs : nparray
+        State indices with shape (chains, transitions + 1)
+    """
+    cumProb = np.asarray(cumProb, dtype=float)
+    cumProb = cumProb.reshape((-1,) + cumProb.shape[-2:])
+    draws = np.asarray(draws, dtype=float).reshape(len(draws), -1)
+    start = np.broadcast_to(np.asarray(start, dtype=np.int64), (draws.shape[0],))
+    matrix = np.broadcast_to(np.asarray(0 if matrix is None else matrix, dtype=np.int64), (draws.shape[0],))
+    if _compiled(_walkSequencesJit):
+        return _walkSequencesJit(np.ascontiguousarray(start), cumProb, np.ascontiguousarray(matrix), draws)
+
+    # step all chains together, one transition at a time
+    last = cumProb.shape[2] - 1
+    seqs = np.empty((draws.shape[0], draws.shape[1] + 1), dtype=np.int64)
+    seqs[:,0] = start
+    for i in range(draws.shape[1]):
+        nxt = np.count_nonzero(cumProb[matrix, seqs[:,i]] <= draws[:,i,np.newaxis], axis=1)
+        seqs[:,i+1] = np.minimum(nxt, last)
+    return seqs
+
+
+
+#-------------------------------------
+#----- FUNCTION: benchmarkKernels ----
+#-------------------------------------
+def benchmarkKernels(size=100000, *, repeat=3, seed=0):
+    """
+    Times each kernel as an interpreted Python loop (equivalent to the original per-element code), compiled with Numba, and with
+    the NumPy fallback, then prints a summary
+
+    Parameters
+    ----------
+    size : int, optional
+        Number of elements processed by each kernel, by default 100000; matchQ is timed on at most 1000 points, as the original
+        pairwise loop scales with the square of the number of points
+    repeat : int, optional
+        Number of timed repetitions, the fastest of which is reported, by default 3
+    seed : int, optional
+        Random number generator seed, by default 0
+
+    Returns
+    -------
+    timings : dict
+        Kernel name mapped to [python time, numba time, numpy time] in seconds; numba time is None without Numba
+    """
+    global useNumba
+
+    rng = np.random.default_rng(seed)
+    xyz = rng.random((size, 3))
+    vec = np.array([0.3, 0.1, 0.0])
+    probs = rng.integers(0, 101, size).astype(float)
+    q = np.sort(rng.random(size) * 8)
+    ints = rng.random(size)
+    cumProb = np.cumsum(np.full((4, 4), 0.25), axis=1)
+    draws = rng.random(size)
+    manyDraws = draws.reshape(100, -1) if size % 100 == 0 else draws.reshape(1, -1)
+    qMatch = q[np.linspace(0, size - 1, min(size, 1000)).astype(int)]
+
+    # kernel name : [public function call, interpreted loop call]
+    cases = {'stackPositions': [lambda: stackPositions(xyz, 3, 10, 0.1, vec, True),
+                                lambda: _stackPositionsLoop(xyz, 3, 10, 0.1, vec, True)],
+             'countFaults': [lambda: countFaults(probs, 25),
+                             lambda: _countFaultsLoop(probs, 25)],
+             'maxIndex': [lambda: maxIndex(ints),
+                          lambda: _maxIndexLoop(ints)],
+             'normalizeWindow': [lambda: normalizeWindow(q, ints, 2.0, 2.2),
+                                 lambda: _normalizeWindowLoop(q, ints, 2.0, 2.2)],
+             'matchQ': [lambda: matchQ(qMatch, qMatch),
+                        lambda: _matchQLoop(qMatch, qMatch)],
+             'walkSequence': [lambda: walkSequence(0, cumProb, draws),
+                              lambda: _walkSequenceLoop(0, cumProb, draws)],
+             'walkSequences': [lambda: walkSequences(0, cumProb, manyDraws),
+                               lambda: _walkSequencesLoop(np.zeros(len(manyDraws), dtype=np.int64), cumProb[np.newaxis],
+                                                          np.zeros(len(manyDraws), dtype=np.int64), manyDraws)]}
+
+    def bestTime(func):
+        # warm up, including JIT compilation
+        func()
+        best = np.inf
+        for r in range(repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    previous = useNumba
+    timings = {}
+    try:
+        for name, (kernel, loop) in cases.items():
+            timings[name] = [bestTime(loop), None, None]
+            if hasNumba:
+                useNumba = True
+                timings[name][1] = bestTime(kernel)
+            useNumba = False
+            timings[name][2] = bestTime(kernel)
+    finally:
+        useNumba = previous
+
+    print('%-16s %12s %12s %12s' % ('kernel', 'python (s)', 'numba (s)', 'numpy (s)'))
+    for name, (tLoop, tCompiled, tFallback) in timings.items():
+        tCompiled = '%12.3e' % tCompiled if tCompiled is not None else '%12s' % 'n/a'
+        print('%-16s %12.3e %s %12.3e' % (name, tLoop, tCompiled, tFallback))
+    return timings
@@ -19,6 +19,8 @@ import pyfaults
 from pyfaults import * 
 from pyfaults.pfInput import pfInput  # If pfInput is a function or class inside the pfInput.py file
 from pyfaults.simXRD import fullSim
+from pyfaults.engine_functions import engines
+from pyfaults.inputfile_functions import readInput
 from pyfaults import tt_to_q
 
 
@@ -48,7 +50,11 @@ class MainWindow(QMainWindow):
         "Wavelength": 0,
         "Broadening": 0,
         "Vector": [0,0,0],
-        "Probability": []
+        "Probability": [],
+        "Engine": "dans",
+        "Precision": "double",
+        "Windows": None,
+        "MemLimit": None
     }
     # create a pandas DF to contain xy data from Diffraction Pattern and Observed Data
     diffx_df = pd.DataFrame(columns=["x", "y"])
@@ -169,6 +175,18 @@ class MainWindow(QMainWindow):
         # Broadening
         self.broadening_info = QLineEdit()
         self.broadening_info.setPlaceholderText("Broadening")
+        # simulation engine
+        self.engine_info = QComboBox()
+        self.engine_info.addItems(sorted(engines) + ["auto"])
+        self.engine_info.setCurrentText("dans")  # Default to Dans_Diffraction
+        # engine options, passed to engines that support them
+        self.precision_info = QComboBox()
+        self.precision_info.addItems(["double", "single"])
+        self.precision_info.setCurrentText("double")
+        self.windows_info = QLineEdit()
+        self.windows_info.setPlaceholderText("Q windows (Optional): min-max, ...")
+        self.memlimit_info = QLineEdit()
+        self.memlimit_info.setPlaceholderText("Memory limit in MB (Optional)")
         # vector
         self.vector_header = QLabel("Vector")
         self.vector_x = QLineEdit()
@@ -207,6 +225,10 @@ class MainWindow(QMainWindow):
         self.grid.addWidget(self.theta_info, 3, 2, 1, 1)
         self.grid.addWidget(self.wavelength_info, 3, 3, 1, 2)
         self.grid.addWidget(self.broadening_info, 3, 5, 1, 2)
+        self.grid.addWidget(self.engine_info, 3, 7, 1, 1)
+        self.grid.addWidget(self.precision_info, 3, 8, 1, 1)
+        self.grid.addWidget(self.windows_info, 5, 7, 1, 1)
+        self.grid.addWidget(self.memlimit_info, 5, 8, 1, 1)
         self.grid.addWidget(self.vector_header, 4, 0, 1, 4)
         self.grid.addWidget(self.vector_x, 5, 0, 1, 1)
         self.grid.addWidget(self.vector_y, 5, 1, 1, 1)
@@ -406,7 +428,12 @@ class MainWindow(QMainWindow):
                     "Wavelength": float(self.wavelength_info.text()),
                     "Broadening": float(self.broadening_info.text()),
                     "Vector": [float(self.vector_x.text()), float(self.vector_y.text()), float(self.vector_z.text())],
-                    "Probability": [float(x) for x in self.prob_info.text().split(",")]
+                    "Probability": [float(x) for x in self.prob_info.text().split(",")],
+                    "Engine": self.engine_info.currentText(),
+                    "Precision": self.precision_info.currentText(),
+                    # optional fields are None when left empty
+                    "Windows": [[float(v) for v in w.split("-")] for w in self.windows_info.text().split(",")] if self.windows_info.text() else None,
+                    "MemLimit": int(float(self.memlimit_info.text()) * 2**20) if self.memlimit_info.text() else None
                 }
                 self.fault_info.update(new_values)
             except ValueError as e:
@@ -500,6 +527,8 @@ class MainWindow(QMainWindow):
         savePath (str) : location to save simulation data to
         pw (float, optional) : peak broadening term
         bg (float, optional) : average of normal background
+        engine (str, optional) : name of simulation engine
+        engineOptions (dict, optional) : further keyword arguments of the engine (precision, windows, memLimit)
 
         Returns
         -------
@@ -508,7 +537,16 @@ class MainWindow(QMainWindow):
         '''
         # simulates XRD pattern, returns normalized intensity values using fullSim() function in simXRD pyfaults file
         # TODO: change back to dir_path eventually
-        fullSim(dir_path, file_name, self.fault_info["Wavelength"], self.fault_info["2Theta"], dir_path, pw=self.fault_info["Broadening"])
+        # only options that were changed from their defaults are passed, so engines without them can still be selected
+        engine_options = {}
+        if self.fault_info["Precision"] != "double":
+            engine_options["precision"] = self.fault_info["Precision"]
+        if self.fault_info["Windows"] is not None:
+            engine_options["windows"] = self.fault_info["Windows"]
+        if self.fault_info["MemLimit"] is not None:
+            engine_options["memLimit"] = self.fault_info["MemLimit"]
+        fullSim(dir_path, file_name, self.fault_info["Wavelength"], self.fault_info["2Theta"], dir_path, pw=self.fault_info["Broadening"],
+                engine=self.fault_info["Engine"], engineOptions=engine_options)
         # save values in diffraction data df
         self.sim_fp = dir_path + file_name + '_sim.txt'
         sim_data = pd.read_csv(self.sim_fp, delim_whitespace=True, header=None, names=["x", "y"])
@@ -578,40 +616,36 @@ class MainWindow(QMainWindow):
     # this function will fill in current fields using the information in the diffraction pattern file
     def fill_data(self):
         # first find all the information in the file and fill in the fault_info dictionary, if you can't find it, leave it empty
-        # Open and read the file
-        with open(self.diff_data, "r") as file:
-            for l in file:
-                line = l.strip()
-                
-                # Extract Layer
-                if line.startswith("FAULT LAYER:L"):
-                    self.fault_info["Layer"] = int(line[len("FAULT LAYER:L"):].strip())
-
-                # Extract N
-                if line.startswith("N:"):
-                    self.fault_info["N"] = int(line[2:].strip())
-
-                # Extract Probability (comma-separated values)
-                if line.startswith("PROBABILITY:"):
-                    prob_values = line[len("PROBABILITY:"):].strip().split(",")
-                    self.fault_info["Probability"] = [float(p) for p in prob_values]
-
-                # Extract Vector (comma-separated inside brackets)
-                if line.startswith("VECTOR:[") and line.endswith("]"):
-                    vector_values = line[8:-1].strip().split(",")
-                    self.fault_info["Vector"] = [float(v) for v in vector_values]
-
-                # Extract Wavelength
-                if line.startswith("WAVELENGTH:"):
-                    self.fault_info["Wavelength"] = float(line[len("WAVELENGTH:"):].strip())
-
-                # Extract 2Theta
-                if line.startswith("MAX TWO THETA:"):
-                    self.fault_info["2Theta"] = float(line[len("MAX TWO THETA:"):].strip())
-
-                # Extract Broadening
-                if line.startswith("BROADENING:"):
-                    self.fault_info["Broadening"] = float(line[len("BROADENING:"):].strip())
+        # the file is parsed once and cached, read_diff_data reuses the same parse through pfInput
+        settings = readInput(self.diff_data)
+
+        # Extract Layer
+        if settings["faultLayer"] and settings["faultLayer"].startswith("L"):
+            self.fault_info["Layer"] = int(settings["faultLayer"][1:])
+
+        # Extract N
+        if settings["nStacks"] is not None:
+            self.fault_info["N"] = settings["nStacks"]
+
+        # Extract Probability
+        if settings["probability"]:
+            self.fault_info["Probability"] = list(settings["probability"])
+
+        # Extract Vector
+        if settings["vector"]:
+            self.fault_info["Vector"] = list(settings["vector"][0])
+
+        # Extract Wavelength
+        if settings["wavelength"] is not None:
+            self.fault_info["Wavelength"] = settings["wavelength"]
+
+        # Extract 2Theta
+        if settings["maxTT"] is not None:
+            self.fault_info["2Theta"] = settings["maxTT"]
+
+        # Extract Broadening
+        if settings["broadening"] is not None:
+            self.fault_info["Broadening"] = settings["broadening"]
         
         # second use this dictionary to fill in the text in the GUI fields
         self.layer_info.setText(str(self.fault_info["Layer"])) 
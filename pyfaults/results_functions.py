@@ -0,0 +1,305 @@
+"""
+results_functions.py
+
+Module containing an indexed SQLite store for the scores of parameter sweeps, so repeated sweeps over many experimental samples
+can be queried instead of scanning text reports
+
+ResultsStore --> A local SQLite database of runs, parameter points and scores per experiment
+
+----------
+TABLES
+    runs --> runId, name, created (ISO time), notes
+    points --> pointId, runId, tag, p, sx, sy, sz, nStacks, seed; one row per supercell of a run, unique by (runId, tag)
+    scores --> pointId, experiment, r2; one row per parameter point and experiment
+Scores are indexed by (experiment, r2) and parameter points by (runId, p, sx, sy, sz), so top-k, slice and map queries do not
+scan the whole store. The database uses write-ahead logging, so several processes can each open a ResultsStore on the same
+file and insert batches while others read
+"""
+
+#---------- import packages ----------
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import sqlite3, threading
+
+
+
+# schema of a new store
+schema = '''
+CREATE TABLE IF NOT EXISTS runs (
+    runId INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    created TEXT NOT NULL,
+    notes TEXT);
+CREATE TABLE IF NOT EXISTS points (
+    pointId INTEGER PRIMARY KEY,
+    runId INTEGER NOT NULL REFERENCES runs(runId),
+    tag TEXT NOT NULL,
+    p REAL, sx REAL, sy REAL, sz REAL, nStacks INTEGER, seed INTEGER,
+    UNIQUE (runId, tag));
+CREATE TABLE IF NOT EXISTS scores (
+    pointId INTEGER NOT NULL REFERENCES points(pointId),
+    experiment TEXT NOT NULL,
+    r2 REAL NOT NULL,
+    PRIMARY KEY (pointId, experiment));
+CREATE INDEX IF NOT EXISTS scoresRank ON scores (experiment, r2);
+CREATE INDEX IF NOT EXISTS pointsParams ON points (runId, p, sx, sy, sz);
+'''
+
+# parameter columns of the points table
+paramCols = ['p', 'sx', 'sy', 'sz', 'nStacks', 'seed']
+
+
+
+#-------------------------------------
+#------- CLASS: ResultsStore ---------
+#-------------------------------------
+class ResultsStore(object):
+
+    #---------- properties ----------
+    fileName = property(lambda self: self._fileName, doc='str : File path of SQLite database')
+
+    #---------- functions ----------
+    def __init__(self, fileName, *, timeout=60.0):
+        """
+        Opens a results store, creating the database and its tables if needed; use as a context manager, or call close when done
+
+        Parameters
+        ----------
+        fileName : str
+            File path of SQLite database
+        timeout : float, optional
+            Seconds to wait for a lock held by another process before an insert fails, by default 60.0
+        """
+        self._fileName = fileName
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(fileName, timeout=timeout, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA foreign_keys=ON')
+        self._db.executescript(schema)
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
+
+    def addRun(self, name, *, notes=None):
+        """
+        Adds a run (one sweep) to the store
+
+        Parameters
+        ----------
+        name : str
+            Name of run
+        notes : str, optional
+            Free-form description of run, by default None
+
+        Returns
+        -------
+        runId : int
+            Identifier of the new run
+        """
+        with self._lock, self._db:
+            cursor = self._db.execute('INSERT INTO runs (name, created, notes) VALUES (?, ?, ?)',
+                                      (name, datetime.now().isoformat(timespec='seconds'), notes))
+        return cursor.lastrowid
+
+    def addPoints(self, runId, points):
+        """
+        Adds or updates the parameter points of a run in one transaction
+
+        Parameters
+        ----------
+        runId : int
+            Identifier of run
+        points : list
+            Points formatted as [tag, p, sx, sy, sz, nStacks, seed]; use None for parameters that do not apply
+        """
+        rows = [(runId, str(tag)) + tuple(_sqlValue(v) for v in params) for tag, *params in points]
+        with self._lock, self._db:
+            self._db.executemany('INSERT INTO points (runId, tag, p, sx, sy, sz, nStacks, seed) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                                 'ON CONFLICT (runId, tag) DO UPDATE SET p=excluded.p, sx=excluded.sx, sy=excluded.sy, '
+                                 'sz=excluded.sz, nStacks=excluded.nStacks, seed=excluded.seed', rows)
+        return
+
+    def addScores(self, runId, experiment, scores):
+        """
+        Adds or replaces the scores of parameter points of a run against an experiment in one transaction; points are matched by
+        tag, and tags not yet in the run are added without parameters
+
+        Parameters
+        ----------
+        runId : int
+            Identifier of run
+        experiment : str
+            Name of experimental data set
+        scores : list
+            Scores formatted as [tag, r2]
+        """
+        rows = [(str(tag), float(r2)) for tag, r2 in scores]
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR IGNORE INTO points (runId, tag) VALUES (?, ?)', [(runId, tag) for tag, r2 in rows])
+            self._db.executemany('INSERT OR REPLACE INTO scores (pointId, experiment, r2) '
+                                 'SELECT pointId, ?, ? FROM points WHERE runId = ? AND tag = ?',
+                                 [(experiment, r2, runId, tag) for tag, r2 in rows])
+        return
+
+    def addResults(self, runId, experiment, results, sVecList, *, nStacks=None, seed=None):
+        """
+        Adds grid search results, as returned by screenGridSearch, as parameter points and scores in one transaction; points are
+        tagged as by genSupercells, so they join the supercells of a run
+
+        Parameters
+        ----------
+        runId : int
+            Identifier of run
+        experiment : str
+            Name of experimental data set
+        results : list
+            Results formatted as [p, stacking vector [sx, sy] or [sx, sy, sz], r2]
+        sVecList : list of nparray
+            List of stacking vectors searched, in the order passed to screenGridSearch or genSupercells
+        nStacks : int, optional
+            Number of stacks of the supercells, by default None
+        seed : int, optional
+            Random number generator seed of the run, by default None
+        """
+        from pyfaults.structure_functions import supercellTag
+
+        sVecs = np.zeros((len(sVecList), 3))
+        sVecs[:, :np.shape(sVecList)[1]] = sVecList
+
+        points = []
+        scores = []
+        for p, vec, r2 in results:
+            vec = (list(vec) + [0.0])[:3]
+            match = np.flatnonzero(np.all(np.isclose(sVecs, vec), axis=1))
+            if len(match) == 0:
+                raise ValueError('stacking vector {0} is not in sVecList'.format(vec))
+            tag = supercellTag(match[0], p)
+            points.append([tag, p] + vec + [nStacks, seed])
+            scores.append([tag, r2])
+        self.addPoints(runId, points)
+        self.addScores(runId, experiment, scores)
+        return
+
+    def topK(self, experiment, k=10, *, runId=None):
+        """
+        Returns the k best scored parameter points against an experiment, best first
+
+        Parameters
+        ----------
+        experiment : str
+            Name of experimental data set
+        k : int, optional
+            Number of points, by default 10
+        runId : int, optional
+            Identifier of run to restrict the query to, by default None (all runs)
+
+        Returns
+        -------
+        DataFrame
+            Columns runId, tag, p, sx, sy, sz, nStacks, seed and r2
+        """
+        where, args = self._where(experiment, runId, {})
+        return self._query(where + ' ORDER BY s.r2 DESC LIMIT ?', args + [int(k)])
+
+    def slice(self, experiment, *, runId=None, **ranges):
+        """
+        Returns the scores of all parameter points against an experiment whose parameters lie in given ranges, best first
+
+        Parameters
+        ----------
+        experiment : str
+            Name of experimental data set
+        runId : int, optional
+            Identifier of run to restrict the query to, by default None (all runs)
+        **ranges : float or [float, float]
+            Parameter (p, sx, sy, sz, nStacks or seed) set to a value, or to [min, max] for an inclusive range,
+            e.g. p=[0.1, 0.3], sx=0.5
+
+        Returns
+        -------
+        DataFrame
+            Columns runId, tag, p, sx, sy, sz, nStacks, seed and r2
+        """
+        where, args = self._where(experiment, runId, ranges)
+        return self._query(where + ' ORDER BY s.r2 DESC', args)
+
+    def scoreMap(self, experiment, x='sx', y='sy', *, runId=None, **ranges):
+        """
+        Returns a map of the best score over two parameters against an experiment, for plotting the parameter space
+
+        Parameters
+        ----------
+        experiment : str
+            Name of experimental data set
+        x : str, optional
+            Parameter along the columns of the map, by default 'sx'
+        y : str, optional
+            Parameter along the rows of the map, by default 'sy'
+        runId : int, optional
+            Identifier of run to restrict the query to, by default None (all runs)
+        **ranges : float or [float, float]
+            Ranges of the other parameters, see slice
+
+        Returns
+        -------
+        DataFrame
+            Best R^2 value for each value of y (rows) and x (columns), NaN where no point was scored
+        """
+        for name in (x, y):
+            if name not in paramCols:
+                raise ValueError('unknown parameter {0!r}, expected one of {1}'.format(name, paramCols))
+        where, args = self._where(experiment, runId, ranges)
+        sql = 'SELECT p.{0} AS x, p.{1} AS y, MAX(s.r2) AS r2 '.format(x, y) + where + ' GROUP BY p.{0}, p.{1}'.format(x, y)
+        with self._lock:
+            table = pd.read_sql_query(sql, self._db, params=args)
+        return table.pivot(index='y', columns='x', values='r2').rename_axis(index=y, columns=x)
+
+    def close(self):
+        """
+        Closes the database connection
+        """
+        with self._lock:
+            self._db.close()
+        return
+
+    def _where(self, experiment, runId, ranges):
+        """
+        Builds the FROM / WHERE clause of a score query and its arguments
+        """
+        sql = ' FROM scores s JOIN points p ON p.pointId = s.pointId WHERE s.experiment = ?'
+        args = [experiment]
+        if runId is not None:
+            sql += ' AND p.runId = ?'
+            args.append(runId)
+        for name, value in ranges.items():
+            if name not in paramCols:
+                raise ValueError('unknown parameter {0!r}, expected one of {1}'.format(name, paramCols))
+            if isinstance(value, (list, tuple)):
+                sql += ' AND p.{0} BETWEEN ? AND ?'.format(name)
+                args.extend(_sqlValue(v) for v in value)
+            else:
+                sql += ' AND p.{0} = ?'.format(name)
+                args.append(_sqlValue(value))
+        return sql, args
+
+    def _query(self, clause, args):
+        """
+        Runs a score query and returns its rows as a DataFrame
+        """
+        sql = 'SELECT p.runId, p.tag, ' + ', '.join('p.' + c for c in paramCols) + ', s.r2' + clause
+        with self._lock:
+            return pd.read_sql_query(sql, self._db, params=args)
+
+
+
+def _sqlValue(value):
+    """
+    Converts NumPy scalars to Python numbers for SQLite
+    """
+    return value.item() if hasattr(value, 'item') else value
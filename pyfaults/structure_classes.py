@@ -4,18 +4,23 @@ structure_classes.py
 Unitcell --> An object representing the unit cell of a crystal structure
 Supercell --> An object constructed by repeatedly stacking individual unit cells along the c-axis and subsequently used to create stacking fault models
 
+----------
+A supercell is fully determined by its unit cell, fault parameters and stacking sequence, a small integer array (int8) with one
+state per stack: 0 for an unfaulted stack and 1 for a stack whose fault layer is displaced. Sequences can be stored, hashed
+(seq.tobytes()) or sent to other processes and turned back into a supercell with Supercell.fromSequence
+
 ----------
 Structure properties are stored in the following lower level classes:
 
 LayerAtom --> Contains information about a specific atom in a unit cell or supercell layer
-Layer --> Contains information about a layer in a unit cell or supercell
-Lattice --> Contains unit cell lattice parameters
+Layer --> Contains information about a layer in a unit cell or supercell; a layer built from arrays (Layer.fromArrays) only
+    creates its LayerAtom objects when its atoms are first accessed
+Lattice --> Contains unit cell lattice parameters and the basis matrices and metric tensors derived from them
 """
 
 #---------- import packages ----------
 import copy as cp
 import numpy as np
-import random as r
 
 
 
@@ -53,7 +58,7 @@ class Unitcell(object):
         self._lattice = None
 
         # feed input parameters to setParam method
-        self.setParam(name, layers, lattice)
+        self.setParam(name=name, layers=layers, lattice=lattice)
         return
     
     def setParam(self, *, name=None, layers=None, lattice=None):
@@ -123,8 +128,11 @@ class Supercell(object):
     intLayer = property(lambda self: self._intLayer, lambda self, val: self.setLayers(intLayer=val),
                         doc='Layer : Layer to be inserted as an intercalation layer')
     
+    sequence = property(lambda self: self._sequence.copy(),
+                        doc='nparray of int8 : Stacking sequence, 1 for each faulted stack and 0 otherwise')
+    
     #---------- functions ----------
-    def __init__(self, unitcell, nStacks, *, fltLayer=None, stackVec=[0,0], stackProb=0.0, zAdj=0, intLayer=None):
+    def __init__(self, unitcell, nStacks, *, fltLayer=None, stackVec=[0,0], stackProb=0.0, zAdj=0, intLayer=None, sequence=None):
         """
         Initializes new instance of Supercell
 
@@ -144,9 +152,9 @@ class Supercell(object):
             Out-of-plane displacement vector component (z), by default 0
         intLayer : Layer, optional
             Layer to be inserted as an intercalation layer, by default None
+        sequence : nparray of int, optional
+            Stacking sequence with one state per stack, by default None (drawn at random from stackProb)
         """
-        
-        from pyfaults.lattice import Lattice
         self._unitcell = unitcell
         # redefines length of c based on number of stacks
         newLatt = Lattice(unitcell.lattice.a,
@@ -163,16 +171,51 @@ class Supercell(object):
         self._stackProb = None
         self._zAdj = None
         self._intLayer = None
-
-        assignProb = self.assignProb()
-        countFaults = self.countFaults(assignProb)
-        self.adjustForZ(countFaults)
-        self.generateLayers(assignProb)
+        self._sequence = None
 
         # feed parameters to setParam method
-        self.setParam(nStacks, fltLayer, stackVec, stackProb, zAdj, intLayer)
+        self.setParam(nStacks=nStacks, fltLayer=fltLayer, stackVec=stackVec, stackProb=stackProb, zAdj=zAdj, intLayer=intLayer)
+
+        if sequence is None:
+            sequence = self.assignProb() <= self.stackProb*100
+        sequence = np.asarray(sequence, dtype=np.int8).ravel()
+        if len(sequence) != nStacks:
+            raise ValueError('sequence has {0} stacks, expected {1}'.format(len(sequence), nStacks))
+        self._sequence = sequence
+
+        self.adjustForZ(np.count_nonzero(sequence))
+        self.generateLayers(sequence)
         return
     
+    @classmethod
+    def fromSequence(cls, unitcell, sequence, *, fltLayer=None, stackVec=[0,0], zAdj=0, intLayer=None):
+        """
+        Regenerates a supercell from its stacking sequence
+
+        Parameters
+        ----------
+        unitcell : Unitcell
+            Unit cell used to construct supercell
+        sequence : nparray of int
+            Stacking sequence, 1 for each faulted stack and 0 otherwise; the number of stacks is its length
+        fltLayer : str, optional
+            Name of layer to apply stacking fault parameters to, by default None
+        stackVec : nparray, optional
+            In-plane displacement vector components in [x,y] format, by default [0,0]
+        zAdj : float, optional
+            Out-of-plane displacement vector component (z), by default 0
+        intLayer : Layer, optional
+            Layer to be inserted as an intercalation layer, by default None
+
+        Returns
+        -------
+        Supercell
+            Supercell with the given stacking sequence
+        """
+        sequence = np.asarray(sequence, dtype=np.int8).ravel()
+        return cls(unitcell, len(sequence), fltLayer=fltLayer, stackVec=stackVec, stackProb=np.mean(sequence != 0), zAdj=zAdj,
+                   intLayer=intLayer, sequence=sequence)
+    
     def setParam(self, *, nStacks=None, fltLayer=None, stackVec=None, stackProb=None, zAdj=None, intLayer=None):
         """
         Sets parameters of Supercell object from __init__ parameters
@@ -196,14 +239,10 @@ class Supercell(object):
 
         Returns
         -------
-        assignProb : list of int
+        assignProb : nparray of int
             Randomly generated probability values for each unit cell stack in supercell
         """
-        assignProb = []
-        while n < self.nStacks:
-            assignProb.append(r.randint(0,100))
-            n += 1
-        return assignProb
+        return np.random.randint(0, 101, self.nStacks)
     
     def countFaults(self, assignProb):
         """
@@ -219,12 +258,8 @@ class Supercell(object):
         countFaults
             Total number of stacks containing stacking faults
         """
-        countFaults = 0
-        stackProbPercent = self.stackProb*100
-        for n in range(len(assignProb)):
-            if assignProb[n] <= stackProbPercent:
-                countFaults += 1
-        return countFaults
+        from pyfaults.kernel_functions import countFaults
+        return countFaults(assignProb, self.stackProb*100)
     
     def adjustForZ(self, countFaults):
         """
@@ -237,18 +272,18 @@ class Supercell(object):
         """
         self.lattice.c = self.lattice.c + (self.zAdj*countFaults)
 
-    def generateLayers(self, assignProb):
+    def generateLayers(self, sequence):
         """
         Generates supercell layers based on stacking fault parameters
 
         Parameters
         ----------
-        assignProb : list of int
-            Randomly generated probability values for each unit cell stack in supercell
+        sequence : nparray of int
+            Stacking sequence, 1 for each faulted stack and 0 otherwise
         """
         newLayers = []
 
-        while n < self.nStacks:
+        for n in range(self.nStacks):
             # tag denotes which stack layer belongs to
             tag = '_n' + str(n+1)
 
@@ -256,8 +291,7 @@ class Supercell(object):
                 newLayer = cp.deepcopy(lyr)
                 newLayer.setParam(lattice=self.lattice)
 
-                stackProbPercent = self.stackProb*100
-                if assignProb[n] <= stackProbPercent and lyr.layerName == self.fltLayer:
+                if sequence[n] != 0 and lyr.layerName == self.fltLayer:
                     newLayer.setParam(layerName=lyr.layerName + tag + '_fault')
                     newLayers.append(self.adjustAtomPos(newLayer, n, True))
 
@@ -267,8 +301,7 @@ class Supercell(object):
                 
                 else:
                     newLayer.setParam(layerName=lyr.layerName + tag)
-                    newLayers.append(self.adjustAtomPos(newLayer, n, True))
-            n += 1
+                    newLayers.append(self.adjustAtomPos(newLayer, n, False))
 
         self._layers = newLayers
         return
@@ -291,18 +324,19 @@ class Supercell(object):
         layer : Layer
             Layer with adjusted atomic positions
         """
-        for atom in layer.atoms:
-            atomLabel = atom.atomLabel.split('_')
+        from pyfaults.kernel_functions import stackPositions
 
-            if isFaulted == True:
-                position = [atom.x, atom.y, ((atom.z + nCurrent + self.zAdj) / self.nStacks)]
-                position = np.add(position, self.stackVec)
-                tag = layer.layerName + '_n' + str(nCurrent+1) + '_fault'
+        if isFaulted == True:
+            tag = layer.layerName + '_n' + str(nCurrent+1) + '_fault'
+        elif isFaulted == False:
+            tag = layer.layerName + '_n' + str(nCurrent+1)
 
-            elif isFaulted == False:
-                position = [atom.x, atom.y, ((atom.z + nCurrent) / self.nStacks)]
-                tag = layer.layerName + '_n' + str(nCurrent+1)
-            
+        # new positions of all atoms in the layer are calculated at once
+        xyz = np.array([atom.xyz for atom in layer.atoms], dtype=float).reshape(-1, 3)
+        positions = stackPositions(xyz, nCurrent, self.nStacks, self.zAdj, self.stackVec, isFaulted)
+
+        for atom, position in zip(layer.atoms, positions):
+            atomLabel = atom.atomLabel.split('_')
             atom.setParam(layerName=tag, atomLabel=atomLabel[0], xyz=position, lattice=self.lattice)
         return layer
 
@@ -428,7 +462,8 @@ class LayerAtom(object):
         self._biso = None
 
         # feed input parameters to setParam method
-        self.setParam(layerName, atomLabel, element, xyz, lattice, occupancy, biso)
+        self.setParam(layerName=layerName, atomLabel=atomLabel, element=element, xyz=xyz, lattice=lattice,
+                      occupancy=occupancy, biso=biso)
         return
     
     def setParam(self, *, layerName=None, atomLabel=None, element=None, xyz=None, lattice=None, occupancy=None, biso=None):
@@ -463,7 +498,8 @@ class LayerAtom(object):
 class Layer(object):
 
     #---------- properties ----------
-    atoms = property(lambda self: self._atoms, lambda self, val: self.setParam(atoms=val),
+    atoms = property(lambda self: self._atoms if self._atoms is not None else self._buildAtoms(),
+                     lambda self, val: self.setParam(atoms=val),
                      doc='list of LayerAtom : All atoms contained in the layer')
     
     lattice = property(lambda self: self._lattice, lambda self, val: self.setParam(lattice=val),
@@ -488,18 +524,92 @@ class Layer(object):
         """
         self._layerName = None
         self._atoms = None
+        self._arrays = None
         self._lattice = None
 
         # feed input parameters to setParam method
         self.setParam(atoms, lattice, layerName)
         return
     
+    @classmethod
+    def fromArrays(cls, layerName, lattice, labels, elements, xyz, occupancy, biso):
+        """
+        Creates a layer from atom arrays; LayerAtom objects are only created when the atoms property is first accessed
+
+        Parameters
+        ----------
+        layerName : str
+            Unique identifier for Layer object
+        lattice : Lattice
+            Unit cell lattice parameters
+        labels : nparray
+            Atom label of each atom, without the layer name suffix
+        elements : nparray
+            Element of each atom
+        xyz : nparray
+            Fractional atomic positions with shape (atoms, 3)
+        occupancy : nparray
+            Site occupancy of each atom
+        biso : nparray
+            Isotropic atomic displacement parameter of each atom
+
+        Returns
+        -------
+        Layer
+            Layer holding the atom arrays
+        """
+        layer = cls(None, lattice, layerName)
+        layer._arrays = (np.asarray(labels, dtype=str), np.asarray(elements, dtype=str),
+                         np.asarray(xyz, dtype=float).reshape(-1, 3), np.asarray(occupancy, dtype=float),
+                         np.asarray(biso, dtype=float))
+        return layer
+    
+    def atomArrays(self):
+        """
+        Returns positions, elements, occupancies and B-factors of the atoms in the layer as arrays, without creating LayerAtom
+        objects for a layer built from arrays
+
+        Returns
+        -------
+        xyz : nparray
+            Fractional atomic positions with shape (atoms, 3)
+        elements : nparray
+            Element of each atom
+        occ : nparray
+            Site occupancy of each atom
+        biso : nparray
+            Isotropic atomic displacement parameter of each atom
+        """
+        if self._atoms is None and self._arrays is not None:
+            labels, elements, xyz, occ, biso = self._arrays
+            return xyz.copy(), elements.copy(), occ.copy(), biso.copy()
+
+        atoms = self.atoms
+        xyz = np.array([a.xyz for a in atoms], dtype=float).reshape(-1, 3)
+        elements = np.array([a.element for a in atoms], dtype=str)
+        occ = np.array([a.occupancy for a in atoms], dtype=float)
+        biso = np.array([a.biso for a in atoms], dtype=float)
+        return xyz, elements, occ, biso
+    
+    def _buildAtoms(self):
+        """
+        Creates the LayerAtom objects of a layer built from arrays
+        """
+        if self._arrays is None:
+            return None
+        labels, elements, xyz, occ, biso = self._arrays
+        self._atoms = [LayerAtom(self.layerName, label, elem, pos, o, b, self.lattice)
+                       for label, elem, pos, o, b in zip(labels.tolist(), elements.tolist(), xyz.copy(), occ.tolist(),
+                                                         biso.tolist())]
+        return self._atoms
+    
     def setParam(self, atoms=None, lattice=None, layerName=None):
         """
         Sets parameters of Layer object from __init__ parameters
         """
         if atoms is not None:
             self._atoms = atoms
+            self._arrays = None
         if lattice is not None:
             self._lattice = lattice
         if layerName is not None:
@@ -577,6 +687,18 @@ class Lattice(object):
     gamma = property(lambda self: self._gamma, lambda self, val: self.setParam(gamma=val),
                      doc='float : Unit cell angle gamma (angle between vectors a and b) in units of degrees')
     
+    direct = property(lambda self: self.geometry()[0],
+                      doc='nparray : 3x3 matrix with rows a, b, c in Cartesian coordinates (Angstroms), a along x and b in the xy-plane')
+    
+    recip = property(lambda self: self.geometry()[1],
+                     doc='nparray : 3x3 matrix with rows a*, b*, c* in inverse Angstroms, without the factor of 2pi')
+    
+    metric = property(lambda self: self.geometry()[2],
+                      doc='nparray : Direct metric tensor (dot products of a, b, c) in square Angstroms')
+    
+    recipMetric = property(lambda self: self.geometry()[3],
+                           doc='nparray : Reciprocal metric tensor (dot products of a*, b*, c*) in inverse square Angstroms')
+    
     #---------- functions ----------
     def __init__(self, a, b, c, alpha, beta, gamma):
         """
@@ -603,9 +725,10 @@ class Lattice(object):
         self._alpha = None
         self._beta = None
         self._gamma = None
+        self._geometry = None
 
         # feed input parameters to setParam method
-        self.setParam(a, b, c, alpha, beta, gamma)
+        self.setParam(a=a, b=b, c=c, alpha=alpha, beta=beta, gamma=gamma)
         return
     
     def setParam(self, *, a=None, b=None, c=None, alpha=None, beta=None, gamma=None):
@@ -624,4 +747,97 @@ class Lattice(object):
             self._beta = beta
         if gamma is not None:
             self._gamma = gamma
-        return
\ No newline at end of file
+        # basis matrices are recalculated on next use
+        self._geometry = None
+        return
+    
+    def geometry(self):
+        """
+        Calculates direct and reciprocal basis matrices and metric tensors once, reusing them until a parameter changes
+
+        Returns
+        -------
+        geometry : tuple of nparray
+            Read-only direct basis, reciprocal basis, direct metric tensor and reciprocal metric tensor
+        """
+        if self._geometry is None:
+            alpha, beta, gamma = np.radians([self.alpha, self.beta, self.gamma])
+            cx = np.cos(beta)
+            cy = (np.cos(alpha) - np.cos(beta)*np.cos(gamma)) / np.sin(gamma)
+            cz = np.sqrt(1 - cx**2 - cy**2)
+
+            direct = np.array([[self.a, 0, 0],
+                               [self.b*np.cos(gamma), self.b*np.sin(gamma), 0],
+                               [self.c*cx, self.c*cy, self.c*cz]], dtype=float)
+            recip = np.linalg.inv(direct).T
+            geometry = (direct, recip, direct @ direct.T, recip @ recip.T)
+            for m in geometry:
+                m.setflags(write=False)
+            self._geometry = geometry
+        return self._geometry
+    
+    def toCartesian(self, xyz):
+        """
+        Converts fractional coordinates to Cartesian coordinates
+
+        Parameters
+        ----------
+        xyz : nparray
+            Fractional coordinates with shape (..., 3)
+
+        Returns
+        -------
+        cart : nparray
+            Cartesian coordinates in Angstroms with shape (..., 3)
+        """
+        return np.asarray(xyz, dtype=float) @ self.direct
+    
+    def toFractional(self, cart):
+        """
+        Converts Cartesian coordinates to fractional coordinates
+
+        Parameters
+        ----------
+        cart : nparray
+            Cartesian coordinates in Angstroms with shape (..., 3)
+
+        Returns
+        -------
+        xyz : nparray
+            Fractional coordinates with shape (..., 3)
+        """
+        return np.asarray(cart, dtype=float) @ self.recip.T
+    
+    def qmag(self, hkl):
+        """
+        Calculates the magnitude of Q of reflections
+
+        Parameters
+        ----------
+        hkl : nparray
+            Miller indices with shape (..., 3)
+
+        Returns
+        -------
+        qmag : nparray
+            Magnitude of Q in inverse Angstroms
+        """
+        return 2*np.pi / self.dSpacing(hkl)
+    
+    def dSpacing(self, hkl):
+        """
+        Calculates the d-spacing of reflections
+
+        Parameters
+        ----------
+        hkl : nparray
+            Miller indices with shape (..., 3)
+
+        Returns
+        -------
+        d : nparray
+            d-spacing in Angstroms (infinite for hkl = 000)
+        """
+        hkl = np.asarray(hkl, dtype=float)
+        with np.errstate(divide='ignore'):
+            return 1 / np.sqrt(np.einsum('...i,ij,...j->...', hkl, self.recipMetric, hkl))
\ No newline at end of file
@@ -4,6 +4,7 @@ structure_functions.py
 Module containing functions related to building unit cell or supercell structures
 
 toCif --> exports CIF file
+writeCif --> writes a P1 CIF from atom arrays in bulk, optionally gzip-compressed
 getLayers --> Imports layer information from formatted DataFrame and returns a list of Layer objects
 importCSV --> generates a unit cell from a CSV of formatted atomic parameters
 --------------
@@ -14,18 +15,26 @@ A, H1, H1+, 0, 0, 0, 1, 2.0
 A, H2, H1+, 0.5, 0.5, 0, 1, 2.0
 ...
 genSupercells --> Generates Supercell instances for all possible combinations in a defined parameter space and exports CIFs in new 'supercells' directory
+iterSupercells --> Lazily generates Supercell instances for all possible combinations in a defined parameter space, one at a time or in chunks
+supercellTag --> Returns the file name tag of a faulted supercell from its stacking vector number and fault probability
+randomSequences --> Draws random stacking sequences for a fault probability in one vectorized step
+batchSupercells --> Builds atomic positions of all supercells in a defined parameter space as one array, without creating Supercell instances
+canonicalSequence --> Converts a stacking sequence to a canonical form shared by all of its cyclic shifts
+uniqueSequences --> Finds stacking sequences (and stacking vectors) that give identical structures up to a cyclic shift
+sampleSequences --> Draws an ensemble of stacking sequences and averaging weights, at random or stratified by number of faults
 """
 
 #---------- import packages ----------
+import numpy as np
 import pandas as pd
-import os
+import gzip, math, os
 
 
 
 #-------------------------------------
 #---------- FUNCTION: toCif ----------
 #-------------------------------------
-def toCif(cell, path, filename):
+def toCif(cell, path, filename, *, gz=False, writer=None):
     """
     Generates CIF of a unit cell or supercell structure
 
@@ -33,12 +42,65 @@ def toCif(cell, path, filename):
     ----------
     cell : Unitcell or Supercell
         Unit cell or supercell structure to convert to CIF format
-    path : str
-        File directory to save CIF
+    path : str or RunArchive
+        File directory to save CIF, or run archive (export_functions) to save it to as supercells/<filename>.cif
     filename : str
         Name of CIF file
+    gz : bool, optional
+        Set to True to write a gzip-compressed CIF (<filename>.cif.gz); ignored for run archives, which compress members
+        themselves, by default False
+    writer : BackgroundWriter, optional
+        Background writer (export_functions) to queue the write on; atom parameters are gathered before this returns, by
+        default None (write immediately)
     """
+    # gather atom parameters in one pass, then hand whole columns to the bulk writer
+    rows = [(a.atomLabel, a.element, a.xyz, a.biso, a.occupancy) for lyr in cell.layers for a in lyr.atoms]
+    labels, elements, xyz, biso, occ = zip(*rows) if rows else ([], [], [], [], [])
+    xyz = np.array(xyz, dtype=float).reshape(-1, 3)
+
+    if isinstance(path, str):
+        fileName, archive = path + filename + ('.cif.gz' if gz else '.cif'), None
+    else:
+        fileName, archive = path.cifMember(filename), path
+
+    if writer is not None:
+        writer.submit(writeCif, fileName, cell.lattice, labels, elements, xyz, biso, occ, archive=archive)
+    else:
+        writeCif(fileName, cell.lattice, labels, elements, xyz, biso, occ, archive=archive)
     
+    return
+
+
+
+#-------------------------------------
+#--------- FUNCTION: writeCif --------
+#-------------------------------------
+def writeCif(fileName, lattice, labels, elements, xyz, biso, occ, *, chunk=10000, archive=None):
+    """
+    Writes a P1 CIF from atom arrays; the atom table is formatted in bulk, chunk by chunk, and streamed to the file, so beyond
+    the input arrays only one chunk of atoms is held as Python objects and text. Files ending in .gz are gzip-compressed
+
+    Parameters
+    ----------
+    fileName : str
+        File path of CIF, or member name if archive is given
+    lattice : Lattice
+        Lattice parameters
+    labels : list of str
+        Label of each atom
+    elements : nparray
+        Element of each atom
+    xyz : nparray
+        Fractional atomic positions with shape (atoms, 3)
+    biso : nparray
+        Isotropic atomic displacement parameter of each atom
+    occ : nparray
+        Site occupancy of each atom
+    chunk : int, optional
+        Number of atoms formatted at once, by default 10000
+    archive : RunArchive, optional
+        Run archive (export_functions) to write the CIF to, by default None
+    """
     lines = []
     # space group info
     lines.extend([
@@ -49,12 +111,12 @@ def toCif(cell, path, filename):
     
     # lattice parameters
     lines.extend([
-        '%-31s %.6g' % ('_cell_length_a', cell.lattice.a),
-        '%-31s %.6g' % ('_cell_length_b', cell.lattice.b),
-        '%-31s %.6g' % ('_cell_length_c', cell.lattice.c),
-        '%-31s %.6g' % ('_cell_angle_alpha', cell.lattice.alpha),
-        '%-31s %.6g' % ('_cell_angle_beta', cell.lattice.beta),
-        '%-31s %.6g' % ('_cell_angle_gamma', cell.lattice.gamma),
+        '%-31s %.6g' % ('_cell_length_a', lattice.a),
+        '%-31s %.6g' % ('_cell_length_b', lattice.b),
+        '%-31s %.6g' % ('_cell_length_c', lattice.c),
+        '%-31s %.6g' % ('_cell_angle_alpha', lattice.alpha),
+        '%-31s %.6g' % ('_cell_angle_beta', lattice.beta),
+        '%-31s %.6g' % ('_cell_angle_gamma', lattice.gamma),
         ''])
     
     # symmetry operations
@@ -74,25 +136,31 @@ def toCif(cell, path, filename):
         '  _atom_site_fract_z',
         '  _atom_site_B_iso_or_equiv',
         '  _atom_site_adp_type',
-        '  _atom_site_occupancy' ])
-
-    # atoms
-    for lyr in cell.layers:
-        for a in lyr.atoms:
-            label = a.atomLabel
-            elem = a.element
-            x = a.x
-            y = a.y
-            z = a.z
-            occ = a.occupancy
-            biso = a.biso
-            aline = ' %-5s %-3s %11.6f %11.6f %11.6f %11.6f %-5s %.4f' % (label, elem, x, y, z, biso, 'Biso', occ)
-            lines.append(aline)
-
-    with open(path + filename + '.cif', 'w') as cif:
-        for i in lines:
-            cif.write(i + '\n')
-    cif.close()
+        '  _atom_site_occupancy',
+        ''])
+
+    xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+    biso = np.asarray(biso, dtype=float)
+    occ = np.asarray(occ, dtype=float)
+    nCols = 8
+
+    # one format operation per chunk of atoms
+    aline = ' %-5s %-3s %11.6f %11.6f %11.6f %11.6f %-5s %.4f\n'
+    if archive is not None:
+        stream = archive.open(fileName, 'w')
+    else:
+        stream = (gzip.open if fileName.endswith('.gz') else open)(fileName, 'wt')
+    with stream as cif:
+        cif.write('\n'.join(lines))
+        for c in range(0, len(xyz), chunk):
+            n = min(chunk, len(xyz) - c)
+            # only the current chunk is converted to Python objects
+            columns = [list(labels[c:c+n]), list(elements[c:c+n])] + xyz[c:c+n].T.tolist()
+            columns.extend([biso[c:c+n].tolist(), ['Biso'] * n, occ[c:c+n].tolist()])
+            values = [None] * (n * nCols)
+            for i, col in enumerate(columns):
+                values[i::nCols] = col
+            cif.write((aline * n) % tuple(values))
     
     return
 
@@ -120,7 +188,7 @@ def getLayers(df, lattice, layerNames):
         Layer objects generated from DataFrame information
     """
     
-    from pyfaults.structure_classes import LayerAtom, Layer, Lattice
+    from pyfaults.structure_classes import Layer, Lattice
     
     # generate new Lattice object
     newLatt = Lattice(a=lattice.a, 
@@ -130,31 +198,19 @@ def getLayers(df, lattice, layerNames):
                           beta=lattice.beta, 
                           gamma=lattice.gamma)
 
+    # whole columns at once, rows grouped by layer name in one pass
+    labels = df['Atom'].to_numpy(dtype=str)
+    elements = df['Element'].to_numpy(dtype=str)
+    xyz = df[['x', 'y', 'z']].to_numpy(dtype=float)
+    occ = df['Occupancy'].to_numpy(dtype=float)
+    biso = df['Biso'].to_numpy(dtype=float)
+    rows = df.groupby('Layer', sort=False).indices
+
+    # atoms of each layer are created on first access
     layers = []
-    # loop through definied layer names
-    for i in range(len(layerNames)):
-        alist = []
-        # loop through dataframe rows
-        for index, row in df.iterrows():
-            # if row corresponds to current layer name
-            if row['Layer'] == layerNames[i]:
-                # grab atomic position values
-                xyz = [row['x'], row['y'], row['z']]
-                    
-                # create new LayerAtom instance
-                newAtom = LayerAtom(layerNames[i], 
-                                    row['Atom'], 
-                                    row['Element'], 
-                                    xyz, 
-                                    row['Occupancy'],
-                                    row['Biso'],
-                                    newLatt)
-                # add new atom to list of layer atoms
-                alist.append(newAtom)
-                
-        # create new Layer instance
-        newLayer = Layer(alist, newLatt, layerNames[i])
-        layers.append(newLayer)
+    for lyrName in layerNames:
+        idx = rows.get(lyrName, np.zeros(0, dtype=int))
+        layers.append(Layer.fromArrays(lyrName, newLatt, labels[idx], elements[idx], xyz[idx], occ[idx], biso[idx]))
     return layers
 
 
@@ -197,7 +253,7 @@ def importCSV(path, filename, lattParams, lyrNames):
     lyrs = getLayers(csv, latt, lyrNames)
     
     unitcell = Unitcell(filename, lyrs, latt)
-    unitcell.toCif(path)
+    toCif(unitcell, path, filename)
     
     return unitcell
 
@@ -205,7 +261,8 @@ def importCSV(path, filename, lattParams, lyrNames):
 #-------------------------------------
 #------ FUNCTION: genSupercells ------
 #-------------------------------------
-def genSupercells(unitcell, nStacks, fltLayer, probList, sVecList):
+def genSupercells(unitcell, nStacks, fltLayer, probList, sVecList, *, dedupe=False, commonRandom=False, seed=None, writer=None,
+                  archive=None, store=None, runId=None):
     """
     Generates Supercell instances within a defined parameter space and exports corresponding CIFs
 
@@ -221,30 +278,447 @@ def genSupercells(unitcell, nStacks, fltLayer, probList, sVecList):
         List of probabilities of stacking fault occurrence, defines one dimension of parameter space
     sVecList : list of nparray
         List of in-plane displacement vector components in [x,y] format and fractional coordinates, defines one dimension of parameter space
+    dedupe : bool, optional
+        Set to True to export one CIF per unique structure (up to a cyclic shift of the stacking sequence) and list the tags of
+        duplicate supercells with the tag of their exported structure in 'supercells/duplicates.txt', by default False
+    commonRandom : bool, optional
+        Set to True to reuse the same random draw per stack for every probability and vector, see iterSupercells, by default False
+    seed : int, optional
+        Random number generator seed, recorded with each point in store, by default None (stacking sequences drawn from the
+        global NumPy random state)
+    writer : BackgroundWriter, optional
+        Background writer (export_functions) to queue CIF exports on, by default None (a writer is created for this call and
+        all CIFs are written when it returns)
+    archive : RunArchive, optional
+        Run archive (export_functions) to export the CIFs and duplicates.txt to instead of the 'supercells' folder, by default
+        None
+    store : ResultsStore, optional
+        Results store (results_functions) to record the tag and parameters of every supercell in, so scores added later by tag
+        (e.g. by simR2vals) can be queried by parameter, by default None
+    runId : int, optional
+        Identifier of the run in store, by default None (a new run named after the unit cell)
+
+    Returns
+    -------
+    counts : list of int
+        Number of generated supercells and number of exported (unique) CIFs, only returned if dedupe is True
     """
+    from pyfaults.export_functions import BackgroundWriter
+
+    if writer is None:
+        with BackgroundWriter() as writer:
+            return genSupercells(unitcell, nStacks, fltLayer, probList, sVecList, dedupe=dedupe, commonRandom=commonRandom,
+                                 seed=seed, writer=writer, archive=archive, store=store, runId=runId)
 
-    from pyfaults.structure_classes import Supercell
-    
     # create 'supercells' folder in working directory
-    if os.path.exists('./supercells/') == False:
+    if archive is None and os.path.exists('./supercells/') == False:
         os.mkdir('./supercells/')
+    cifPath = './supercells/' if archive is None else archive
     
-    cellList = []
+    keys = {}
+    duplicates = []
+    points = []
+    
+    # queue CIF export of each supercell as soon as it is generated, so writing overlaps with generating the next one
+    for cellTag, params, cell in iterSupercells(unitcell, nStacks, fltLayer, probList, sVecList, commonRandom=commonRandom,
+                                                seed=seed):
+        vec = [None, None, None] if params[1] is None else (list(params[1]) + [0.0])[:3]
+        points.append([cellTag, params[0]] + vec + [nStacks, seed])
+        if dedupe:
+            canonical = canonicalSequence(cell.sequence)
+            key = canonical.tobytes()
+            if canonical.any():
+                key = key + np.round(np.asarray(params[1], dtype=float), 8).tobytes()
+            if key in keys:
+                duplicates.append([cellTag, keys[key]])
+                continue
+            keys[key] = cellTag
+        toCif(cell, cifPath, cellTag, writer=writer)
+    
+    writer.flush()
+    if dedupe:
+        dupText = ''.join('{0} {1}\n'.format(cellTag, sameAs) for (cellTag, sameAs) in duplicates)
+        if archive is None:
+            with open('./supercells/duplicates.txt', 'w') as f:
+                f.write(dupText)
+        else:
+            archive.write('supercells/duplicates.txt', dupText)
+
+    # every supercell, including duplicates, is a parameter point of the run
+    if store is not None:
+        if runId is None:
+            runId = store.addRun(unitcell.name)
+        store.addPoints(runId, points)
     
+    if dedupe:
+        nCells = len(probList) * len(sVecList) + 1
+        return [nCells, nCells - len(duplicates)]
+    return
+
+
+
+#-------------------------------------
+#----- FUNCTION: iterSupercells ------
+#-------------------------------------
+def iterSupercells(unitcell, nStacks, fltLayer, probList, sVecList, *, chunk=None, commonRandom=False, seed=None):
+    """
+    Lazily generates Supercell instances within a defined parameter space, starting with the unfaulted supercell; only the
+    supercells of the current chunk are held in memory
+
+    Parameters
+    ----------
+    unitcell : Unitcell
+        Unit cell used to construct supercell
+    nStacks : int
+        Number of unit cells stacked to generate supercell
+    fltLayer : str
+        Name of layer to apply stacking fault parameters to
+    probList : list of float
+        List of probabilities of stacking fault occurrence, defines one dimension of parameter space
+    sVecList : list of nparray
+        List of in-plane displacement vector components in [x,y] format and fractional coordinates, defines one dimension of parameter space
+    chunk : int, optional
+        Number of supercells to yield at once as a list, by default None (one at a time)
+    commonRandom : bool, optional
+        Set to True to draw one random integer from 0 to 100 per stack and reuse it for every probability and vector (common
+        random numbers); a stack is faulted when its draw falls at or below the fault probability percentage, as in
+        Supercell.assignProb, so faults are nested as the probability increases and neighbouring models differ only by the
+        faults added between them, by default False (fresh draws per supercell)
+    seed : int, optional
+        Random number generator seed, by default None (stacking sequences drawn from the global NumPy random state)
+
+    Yields
+    ------
+    cellTag : str
+        File name tag with vector number and probability percentage, 'Unfaulted' for the unfaulted supercell
+    params : list
+        Fault probability and stacking vector of the supercell, [0.0, None] for the unfaulted supercell
+    cell : Supercell
+        Generated supercell
+    """
+    if chunk is not None:
+        batch = []
+        for item in iterSupercells(unitcell, nStacks, fltLayer, probList, sVecList, commonRandom=commonRandom, seed=seed):
+            batch.append(item)
+            if len(batch) == chunk:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+        return
+
+    from pyfaults.structure_classes import Supercell
+
+    rng = np.random.default_rng(seed)
+    draws = _faultDraws(rng, nStacks) if commonRandom else None
+
     # generate unfaulted supercell
-    UF = Supercell(unitcell, nStacks)
-    cellList.append([UF, 'Unfaulted'])
+    yield 'Unfaulted', [0.0, None], Supercell(unitcell, nStacks, sequence=np.zeros(nStacks, dtype=np.int8))
     
     # generate faulted supercells over parameter space
     for p in range(len(probList)):
+        sequence = None if draws is None else _faultedStacks(draws, probList[p])
         for s in range(len(sVecList)):
-            FLT = Supercell(unitcell, nStacks, fltLayer=fltLayer, stackVec=sVecList[s], stackProb=probList[p])
-            # creates file name tag with vector number and probability percentage
-            cellTag = 'S' + str(s+1) + '_P' + str(int(probList[p]*100))
-            cellList.append([FLT, cellTag])
-    
-    # export CIF for each supercell
-    for c in range(len(cellList)):
-        toCif((cellList[c][0]), './supercells/', cellList[c][1])
-    
-    return               
\ No newline at end of file
+            if draws is None and seed is not None:
+                # same rule as Supercell.assignProb, drawn from the seeded generator
+                sequence = _faultedStacks(_faultDraws(rng, nStacks), probList[p])
+            FLT = Supercell(unitcell, nStacks, fltLayer=fltLayer, stackVec=sVecList[s], stackProb=probList[p], sequence=sequence)
+            cellTag = supercellTag(s, probList[p])
+            yield cellTag, [probList[p], sVecList[s]], FLT
+
+
+
+def _faultDraws(rng, shape):
+    """
+    Draws one random integer from 0 to 100 per stack, as Supercell.assignProb does from the global NumPy random state
+    """
+    return rng.integers(0, 101, shape)
+
+def _faultedStacks(draws, stackProb):
+    """
+    Stacking sequences (int8) from _faultDraws; a stack is faulted when its draw falls at or below the fault probability
+    percentage, the rule of Supercell, so a probability p faults a stack with probability (floor(100p) + 1) / 101
+    """
+    return (draws <= np.asarray(stackProb) * 100).astype(np.int8)
+
+
+
+#-------------------------------------
+#------ FUNCTION: supercellTag -------
+#-------------------------------------
+def supercellTag(vecIndex, stackProb):
+    """
+    Returns the file name tag of a faulted supercell, as used for CIFs, simulated patterns and results store points
+
+    Parameters
+    ----------
+    vecIndex : int
+        Index of stacking vector in sVecList, starting at 0
+    stackProb : float
+        Probability stacking fault will occur
+
+    Returns
+    -------
+    cellTag : str
+        File name tag with vector number and probability percentage, e.g. 'S1_P10'
+    """
+    return 'S' + str(vecIndex+1) + '_P' + str(int(stackProb*100))
+
+
+
+#-------------------------------------
+#----- FUNCTION: randomSequences -----
+#-------------------------------------
+def randomSequences(nStacks, stackProb, *, size=None, seed=None):
+    """
+    Draws random stacking sequences for a fault probability in one vectorized step, with the rule of Supercell.assignProb (a
+    random integer from 0 to 100 per stack, faulted at or below 100 stackProb); use Supercell.fromSequence to build the
+    corresponding supercells
+
+    Parameters
+    ----------
+    nStacks : int
+        Number of unit cells stacked to generate supercell
+    stackProb : float
+        Probability stacking fault will occur
+    size : int, optional
+        Number of sequences to draw, by default None (a single sequence)
+    seed : int or Generator, optional
+        Random number generator or seed, by default None
+
+    Returns
+    -------
+    sequence : nparray of int8
+        Stacking sequence, 1 for each faulted stack and 0 otherwise, with shape (nStacks,) or (size, nStacks)
+    """
+    rng = np.random.default_rng(seed)
+    shape = nStacks if size is None else (size, nStacks)
+    return _faultedStacks(_faultDraws(rng, shape), stackProb)
+
+
+
+#-------------------------------------
+#----- FUNCTION: batchSupercells -----
+#-------------------------------------
+def batchSupercells(unitcell, nStacks, fltLayer, probList, sVecList, *, commonRandom=False, seed=None):
+    """
+    Builds atomic positions of the unfaulted supercell and all faulted supercells within a defined parameter space as one
+    (models x atoms x 3) array, in the same order as genSupercells and without creating Supercell, Layer or LayerAtom instances;
+    the output can be passed directly to XRD_functions.batchPattern. Out-of-plane adjustment (zAdj) and intercalation layers are
+    not supported, as they change the lattice or number of atoms between models
+
+    Parameters
+    ----------
+    unitcell : Unitcell
+        Unit cell used to construct supercell
+    nStacks : int
+        Number of unit cells stacked to generate supercell
+    fltLayer : str
+        Name of layer to apply stacking fault parameters to
+    probList : list of float
+        List of probabilities of stacking fault occurrence, defines one dimension of parameter space
+    sVecList : list of nparray
+        List of displacement vectors in [x,y] or [x,y,z] format and fractional coordinates, defines one dimension of parameter space
+    commonRandom : bool, optional
+        Set to True to reuse the same random draw per stack for every probability and vector, see iterSupercells, by default False
+    seed : int, optional
+        Random number generator seed, by default None
+
+    Returns
+    -------
+    cellTags : list of str
+        File name tag of each model, as used by genSupercells
+    sequences : nparray of int8
+        Stacking sequence of each model with shape (models, stacks)
+    xyz : nparray
+        Fractional atomic positions in the supercell with shape (models, atoms, 3)
+    elements : nparray
+        Element of each atom
+    occ : nparray
+        Site occupancy of each atom
+    biso : nparray
+        Isotropic atomic displacement parameter of each atom
+    lattice : Lattice
+        Lattice parameters of the supercell
+    """
+    from pyfaults.structure_classes import Lattice
+    from pyfaults.scattering_functions import atomArrays
+
+    # unit cell atoms repeated for every stack, stack by stack as in Supercell.layers
+    ucXYZ, ucElements, ucOcc, ucBiso = atomArrays(unitcell.layers)
+    inFltLayer = np.concatenate([[lyr.layerName == fltLayer] * len(lyr.atoms) for lyr in unitcell.layers]).astype(bool)
+    nAtoms = len(ucXYZ)
+    stack = np.repeat(np.arange(nStacks), nAtoms)
+    base = np.tile(ucXYZ, (nStacks, 1))
+    base[:,2] = (base[:,2] + stack) / nStacks
+
+    # one model per probability x vector pair, after the unfaulted model
+    sVecs = np.zeros((len(sVecList), 3))
+    sVecs[:, :np.shape(sVecList)[1]] = sVecList
+    probs = np.repeat(np.asarray(probList, dtype=float), len(sVecs))
+    vecs = np.vstack([np.zeros(3), np.tile(sVecs, (len(probList), 1))])
+    cellTags = ['Unfaulted'] + [supercellTag(s, p) for p in probList for s in range(len(sVecs))]
+
+    rng = np.random.default_rng(seed)
+    sequences = np.zeros((len(vecs), nStacks), dtype=np.int8)
+    draws = _faultDraws(rng, nStacks if commonRandom else (len(probs), nStacks))
+    sequences[1:] = _faultedStacks(draws, probs[:, np.newaxis])
+
+    shifted = sequences[:, stack] * np.tile(inFltLayer, nStacks)
+    xyz = base + shifted[:, :, np.newaxis] * vecs[:, np.newaxis, :]
+
+    lattice = Lattice(unitcell.lattice.a, unitcell.lattice.b, unitcell.lattice.c * nStacks,
+                      unitcell.lattice.alpha, unitcell.lattice.beta, unitcell.lattice.gamma)
+    return cellTags, sequences, xyz, np.tile(ucElements, nStacks), np.tile(ucOcc, nStacks), np.tile(ucBiso, nStacks), lattice
+
+
+
+#-------------------------------------
+#---- FUNCTION: canonicalSequence ----
+#-------------------------------------
+def canonicalSequence(sequence):
+    """
+    Converts a stacking sequence to a canonical form shared by all of its cyclic shifts; a cyclic shift only moves the origin of
+    a periodic supercell along c, so supercells with the same canonical sequence give identical PXRD patterns
+
+    Parameters
+    ----------
+    sequence : nparray of int
+        Stacking sequence, nonzero for each faulted stack
+
+    Returns
+    -------
+    canonical : nparray of int8
+        Cyclic shift of the sequence that starts at the lexicographically smallest run of (state, gap to next fault) pairs
+    """
+    sequence = np.asarray(sequence, dtype=np.int8).ravel()
+    faults = np.flatnonzero(sequence)
+    if len(faults) == 0:
+        return sequence.copy()
+
+    # the sequence is fully described by each fault state and the gap to the next fault
+    gaps = np.diff(np.append(faults, faults[0] + len(sequence)))
+    runs = list(zip(sequence[faults].tolist(), gaps.tolist()))
+    return np.roll(sequence, -faults[_leastRotation(runs)])
+
+def _leastRotation(items):
+    """
+    Index of the lexicographically smallest rotation of a list (Booth's algorithm, linear time)
+    """
+    doubled = items + items
+    fail = [-1] * len(doubled)
+    k = 0
+    for j in range(1, len(doubled)):
+        item = doubled[j]
+        i = fail[j - k - 1]
+        while i != -1 and item != doubled[k + i + 1]:
+            if item < doubled[k + i + 1]:
+                k = j - i - 1
+            i = fail[i]
+        if item != doubled[k + i + 1]:
+            if item < doubled[k]:
+                k = j
+            fail[j - k] = -1
+        else:
+            fail[j - k] = i + 1
+    return k
+
+
+
+#-------------------------------------
+#----- FUNCTION: uniqueSequences -----
+#-------------------------------------
+def uniqueSequences(sequences, stackVecs=None):
+    """
+    Finds stacking sequences that give identical structures up to a cyclic shift, so each unique structure only needs to be
+    simulated once; unfaulted sequences are identical whatever their stacking vector
+
+    Parameters
+    ----------
+    sequences : nparray of int
+        Stacking sequences with shape (models, stacks)
+    stackVecs : nparray, optional
+        Stacking vector of each model, by default None (all the same)
+
+    Returns
+    -------
+    unique : nparray of int
+        Index of the first model of each unique structure
+    inverse : nparray of int
+        Index into unique of the structure of each model, so results of unique models expand with results[inverse]
+    """
+    keys = {}
+    unique = []
+    inverse = np.empty(len(sequences), dtype=np.int64)
+    for m, seq in enumerate(sequences):
+        canonical = canonicalSequence(seq)
+        key = canonical.tobytes()
+        if stackVecs is not None and canonical.any():
+            key = key + np.round(np.asarray(stackVecs[m], dtype=float), 8).tobytes()
+        if key not in keys:
+            keys[key] = len(unique)
+            unique.append(m)
+        inverse[m] = keys[key]
+    return np.array(unique, dtype=np.int64), inverse
+
+
+
+#-------------------------------------
+#----- FUNCTION: sampleSequences -----
+#-------------------------------------
+def sampleSequences(nStacks, stackProb, size, *, sampling='stratified', seed=None):
+    """
+    Draws an ensemble of stacking sequences for a fault probability together with the weights used to average their patterns
+
+    With sampling='random' every stack is faulted independently with the rule of randomSequences, so the number of faults
+    follows the binomial distribution and dominates the spread between realizations. With sampling='stratified' the numbers of faults are taken at evenly spaced
+    quantiles of the binomial distribution (one random point in each of size strata of equal probability), so every number of
+    faults is represented in proportion to its binomial probability, and the faults of each realization are placed at uniformly
+    random stacks; all realizations carry equal weight
+
+    Parameters
+    ----------
+    nStacks : int
+        Number of unit cells stacked to generate supercell
+    stackProb : float
+        Probability stacking fault will occur
+    size : int
+        Number of sequences to draw
+    sampling : str, optional
+        'stratified' or 'random', by default 'stratified'
+    seed : int or Generator, optional
+        Random number generator or seed; calling with the same integer seed for every fault probability reuses the same draws
+        (common random numbers), so the sampled faults are nested as the probability increases, by default None
+
+    Returns
+    -------
+    sequences : nparray of int8
+        Stacking sequences with shape (size, nStacks), 1 for each faulted stack and 0 otherwise
+    weights : nparray
+        Weight of each sequence in the ensemble average (1/size)
+    """
+    rng = np.random.default_rng(seed)
+    if sampling == 'random':
+        return randomSequences(nStacks, stackProb, size=size, seed=rng), np.full(size, 1 / size)
+    if sampling != 'stratified':
+        raise ValueError("sampling must be 'stratified' or 'random', got {0!r}".format(sampling))
+
+    # binomial distribution of the number of faults
+    k = np.arange(nStacks + 1)
+    if stackProb <= 0 or stackProb >= 1:
+        pmf = (k == round(stackProb * nStacks)).astype(float)
+    else:
+        logPmf = [math.lgamma(nStacks + 1) - math.lgamma(i + 1) - math.lgamma(nStacks - i + 1) for i in k]
+        pmf = np.exp(np.array(logPmf) + k*np.log(stackProb) + (nStacks - k)*np.log1p(-stackProb))
+    cdf = np.cumsum(pmf)
+    cdf = cdf / cdf[-1]
+
+    # one fault count per probability stratum
+    u = (np.arange(size) + rng.random(size)) / size
+    counts = np.minimum(np.searchsorted(cdf, u, side='right'), nStacks)
+
+    # faults at uniformly random stacks: the stacks with the lowest random keys
+    ranks = np.argsort(np.argsort(rng.random((size, nStacks)), axis=1), axis=1)
+    sequences = (ranks < counts[:, np.newaxis]).astype(np.int8)
+
+    return sequences, np.full(size, 1 / size)
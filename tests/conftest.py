@@ -0,0 +1,13 @@
+import pytest
+
+from pyfaults.structure_classes import Lattice, LayerAtom, Layer, Unitcell
+
+
+@pytest.fixture
+def unitcell():
+    """Two-layer hexagonal unit cell with a mobile Co layer 'B'"""
+    lattice = Lattice(3.0, 3.0, 5.0, 90, 90, 120)
+    layerA = Layer([LayerAtom('A', 'Li1', 'Li1+', [0, 0, 0], 1, 1.0, lattice),
+                    LayerAtom('A', 'O1', 'O2-', [1/3, 2/3, 0.2], 1, 0.5, lattice)], lattice, 'A')
+    layerB = Layer([LayerAtom('B', 'Co1', 'Co', [2/3, 1/3, 0.5], 1, 0.5, lattice)], lattice, 'B')
+    return Unitcell('test', [layerA, layerB], lattice)
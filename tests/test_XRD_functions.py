@@ -0,0 +1,118 @@
+import numpy as np
+
+from pyfaults.engine_functions import getEngine
+
+
+inputText = """NAME: test
+TYPE: Displacement
+LATTICE: 3.0, 3.0, 5.0, 90, 90, 120
+NUM LAYERS: 2
+L1: Li1, O1
+L2: Co1
+Li1: Li1+, 0, 0, 0, 1, 1.0
+O1: O2-, 0.333333, 0.666667, 0.2, 1, 0.5
+Co1: Co, 0.666667, 0.333333, 0.5, 1, 0.5
+FAULT LAYER: L2
+PROBABILITY: 0.2
+VECTOR: [0.333333, 0.333333, 0]
+N: 5
+WAVELENGTH: 1.5406
+MAX TWO THETA: 40
+BROADENING: 0.02
+"""
+
+
+def test_simulate_defaults_to_dans(tmp_path, monkeypatch):
+    from pyfaults.XRD_functions import simulate
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'input.txt').write_text(inputText)
+    simulate('input.txt')
+
+    assert sorted(p.name for p in (tmp_path / 'simulations').iterdir()) == ['S1_P20_sim.txt', 'Unfaulted_sim.txt']
+    q, ints = np.loadtxt(tmp_path / 'simulations' / 'Unfaulted_sim.txt', unpack=True)
+    qDans, intsDans = getEngine('dans')('./supercells/', 'Unfaulted', 1.5406, 40, pw=0.02)
+    assert np.array_equal(q, qDans) and np.array_equal(ints, intsDans)
+
+
+def test_batchSim_dedupe_counts_and_keeps_intercalation_layers(unitcell):
+    from pyfaults.structure_classes import Supercell, Layer, LayerAtom
+    from pyfaults.XRD_functions import batchSim
+
+    latt = unitcell.lattice
+    intLayers = [Layer([LayerAtom('I', 'Li2', 'Li1+', [0, 0, z], 1, 1.0, latt)], latt, 'I') for z in (0.7, 0.8)]
+    sequence = np.array([1, 0, 0, 1, 0, 0], dtype=np.int8)
+
+    def cell(sequence, intLayer):
+        return Supercell(unitcell, 6, fltLayer='B', stackVec=[1/3, 1/3], stackProb=0.5, intLayer=intLayer, sequence=sequence)
+
+    # a repeated supercell is simulated once, one with a different intercalation layer is not a duplicate
+    cells = [cell(sequence, intLayers[0]), cell(sequence, intLayers[0]), cell(sequence, intLayers[1])]
+    q, ints, nUnique = batchSim(cells, 1.5406, 60, pw=0.02)
+    assert nUnique == 2
+    assert np.array_equal(ints[0], ints[1])
+    assert not np.allclose(ints[0], ints[2])
+
+    q, separate = batchSim(cells, 1.5406, 60, pw=0.02, dedupe=False)
+    assert np.allclose(separate, ints)
+
+
+def test_multiSim_exports_each_wavelength(unitcell, tmp_path):
+    from pyfaults.structure_functions import toCif
+    from pyfaults.XRD_functions import multiSim
+
+    path = str(tmp_path) + '/'
+    toCif(unitcell, path, 'uc')
+    patterns = multiSim(path, 'uc', [1.5406, 1.5444], 60, path, pw=0.02)
+
+    assert len(patterns) == 2
+    for i, (q, ints) in enumerate(patterns):
+        saved = np.loadtxt(path + 'uc_sim_wl' + str(i+1) + '.txt')
+        assert np.allclose(saved, np.column_stack([q, ints]))
+    # the longer wavelength reaches a smaller Q
+    assert patterns[1][0].max() < patterns[0][0].max()
+
+
+def test_batchPattern_matches_per_model_patterns(unitcell):
+    from pyfaults.scattering_functions import atomArrays, genHKL, structureFactor, powderPattern
+    from pyfaults.structure_classes import Supercell
+    from pyfaults.XRD_functions import batchPattern, tt_to_q
+
+    sequences = [[0, 0, 0, 0, 0], [1, 0, 0, 1, 0], [1, 1, 1, 1, 1]]
+    cells = [Supercell(unitcell, 5, fltLayer='B', stackVec=[1/3, 1/3], sequence=seq) for seq in sequences]
+    arrays = [atomArrays(cell.layers) for cell in cells]
+    xyz = np.array([a[0] for a in arrays])
+    elements, occ, biso = arrays[0][1:]
+
+    q, ints = batchPattern(xyz, elements, occ, biso, cells[0].lattice, 1.5406, 60, pw=0.02)
+    assert ints.shape == (3, len(q))
+
+    hkl, qmag = genHKL(cells[0].lattice, tt_to_q(60, 1.5406))
+    for model, cellXYZ in enumerate(xyz):
+        sf = structureFactor(hkl, qmag, cellXYZ, elements, occ, biso)
+        expected = powderPattern(qmag, 2 * np.abs(sf)**2, tt_to_q(60, 1.5406), pw=0.02)[1]
+        assert np.allclose(ints[model], expected, rtol=1e-9, atol=1e-9 * expected.max())
+
+    # tiles far smaller than the problem give the same patterns
+    q, tiled = batchPattern(xyz, elements, occ, biso, cells[0].lattice, 1.5406, 60, pw=0.02, memLimit=2**16)
+    assert np.allclose(tiled, ints, rtol=1e-9, atol=1e-9 * ints.max())
+
+
+def test_windowed_batchPattern_matches_full_pattern(unitcell):
+    from pyfaults.scattering_functions import atomArrays, getWindows, inWindows
+    from pyfaults.structure_classes import Supercell
+    from pyfaults.XRD_functions import batchPattern
+
+    cell = Supercell(unitcell, 5, fltLayer='B', stackVec=[1/3, 1/3], sequence=[1, 0, 0, 1, 0])
+    xyz, elements, occ, biso = atomArrays(cell.layers)
+    q, full = batchPattern(xyz[np.newaxis], elements, occ, biso, cell.lattice, 1.5406, 60, pw=0.02)
+
+    # windows from a mask over the Q points, as from experimental data
+    mask = ((q > 1.0) & (q < 1.6)) | ((q > 2.5) & (q < 3.0))
+    windows = getWindows(q, mask)
+    assert len(windows) == 2 and np.array_equal(inWindows(q, windows), mask)
+
+    qWin, part = batchPattern(xyz[np.newaxis], elements, occ, biso, cell.lattice, 1.5406, 60, pw=0.02, windows=windows)
+    assert np.array_equal(qWin, q[mask])
+    assert np.allclose(part, full[:, mask], rtol=1e-9, atol=1e-9 * full.max())
+
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from pyfaults.analysis_functions import rmcFit, r2val
+from pyfaults.structure_classes import Supercell
+
+
+@pytest.fixture
+def exptData():
+    q = np.linspace(0.5, 4.0, 400)
+    return q, 1 + np.exp(-((q - 2.0) / 0.05)**2)
+
+
+def test_rmcFit_accepts_sequences_and_shifts(unitcell, exptData, tmp_path):
+    stackVec = [1/3, 1/3, 0]
+    expected = np.outer([0, 1, 1, 0], stackVec)
+
+    def start(start):
+        # without moves the best sequence is the starting one
+        return rmcFit(unitcell, 4, 'B', stackVec, *exptData, 1.5406, 60, start=start, nMoves=0)[0]
+
+    assert np.allclose(start([0, 1, 1, 0]), expected)
+    assert np.allclose(start(np.array([0, 1, 1, 0], dtype=np.int8)), expected)
+    assert np.allclose(start(Supercell(unitcell, 4, fltLayer='B', stackVec=stackVec, sequence=[0, 1, 1, 0])), expected)
+    assert np.allclose(start(expected[:, :2]), expected)
+    assert np.allclose(start(None), 0)
+    with pytest.raises(ValueError):
+        start([0, 1, 1])
+
+    # a checkpoint restarts from the sequence it holds
+    checkpoint = str(tmp_path / 'rmc.npz')
+    rmcFit(unitcell, 4, 'B', stackVec, *exptData, 1.5406, 60, start=[0, 1, 1, 0], nMoves=0, checkpoint=checkpoint)
+    assert np.allclose(start(checkpoint), expected)
+
+
+def test_rmcFit_never_loses_best_score(unitcell, exptData):
+    shifts, bestR2, r2List = rmcFit(unitcell, 6, 'B', [1/3, 1/3, 0], *exptData, 1.5406, 60, nMoves=200, temp=1e-2, seed=0)
+    assert r2List.shape == (200,)
+    assert bestR2 >= r2List.max() - 1e-12
+    assert shifts.shape == (6, 3)
+
+
+def test_r2val_windows_restrict_compared_points():
+    q = np.round(np.linspace(0.5, 4.0, 701), 3)
+    ints = np.exp(-((q - 2.0) / 0.1)**2)
+    other = ints.copy()
+    other[q > 3.0] += 1.0
+
+    assert r2val(q, q, ints, other) < 0.5
+    assert r2val(q, q, ints, other, windows=[[0.5, 3.0]]) == 1.0
+    assert r2val(q, q, ints, other, windows=q <= 3.0) == 1.0
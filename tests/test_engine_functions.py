@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from pyfaults.engine_functions import getEngine, findEngine, readCif
+from pyfaults.structure_classes import Supercell
+from pyfaults.structure_functions import toCif
+
+
+@pytest.fixture
+def supercellCif(unitcell, tmp_path):
+    """Directory holding 'sc.cif', a faulted supercell written by toCif"""
+    np.random.seed(0)
+    toCif(Supercell(unitcell, 10, fltLayer='B', stackVec=[1/3, 1/3], stackProb=0.3), str(tmp_path) + '/', 'sc')
+    return str(tmp_path) + '/'
+
+
+@pytest.mark.parametrize('pw', [0.0, 0.02])
+def test_native_matches_dans(supercellCif, pw):
+    qNative, intsNative = getEngine('native')(supercellCif, 'sc', 1.5406, 60, pw=pw)
+    qDans, intsDans = getEngine('dans')(supercellCif, 'sc', 1.5406, 60, pw=pw)
+
+    # measured agreement is 5e-10 of the strongest peak
+    assert np.allclose(qNative, qDans, rtol=0, atol=1e-12)
+    assert np.abs(intsNative - intsDans).max() < 1e-8 * intsDans.max()
+
+
+def test_findEngine_prefers_fastest():
+    assert findEngine('periodic') == 'native'
+    assert findEngine('finiteSize') == 'debye'
+    with pytest.raises(ValueError):
+        findEngine('periodic', 'finiteSize')
+
+
+def test_readCif_rejects_unknown_elements(supercellCif):
+    with open(supercellCif + 'sc.cif') as f:
+        text = f.read()
+    with open(supercellCif + 'bad.cif', 'w') as f:
+        f.write(text.replace(' Co ', ' Xx ', 1))
+
+    with pytest.raises(ValueError, match='Xx'):
+        readCif(supercellCif, 'bad')
+
+
+def test_fullSim_auto_requires_only_capability_options(supercellCif, tmp_path, monkeypatch):
+    from pyfaults import engine_functions as ef
+    from pyfaults.XRD_functions import fullSim
+
+    used = []
+    for name in ['native', 'debye']:
+        monkeypatch.setitem(ef.engines[name], 'function',
+                            lambda *args, name=name, **kwargs: used.append((name, kwargs)) or (np.zeros(1), np.zeros(1)))
+
+    # size is passed to the engine without being a capability, windows must be supported by the engine
+    fullSim(supercellCif, 'sc', 1.5406, 60, str(tmp_path) + '/', engine='auto', engineOptions={'size': 20.0},
+            require=('finiteSize',))
+    fullSim(supercellCif, 'sc', 1.5406, 60, str(tmp_path) + '/', pw=0.02, engine='auto', engineOptions={'windows': [[1, 2]]})
+    assert used == [('debye', {'pw': 0.0, 'bg': 0, 'size': 20.0}), ('native', {'pw': 0.02, 'bg': 0, 'windows': [[1, 2]]})]
+
+    with pytest.raises(ValueError, match='precision'):
+        fullSim(supercellCif, 'sc', 1.5406, 60, str(tmp_path) + '/', engine='auto', engineOptions={'precision': 'single'},
+                require=('finiteSize',))
+
+
+def test_loadCrystal_matches_dans_parser(supercellCif):
+    import Dans_Diffraction as df
+    from pyfaults.engine_functions import loadCrystal
+
+    fast = loadCrystal(supercellCif, 'sc')
+    dans = df.Crystal(supercellCif + 'sc.cif')
+
+    assert np.allclose(fast.Cell.lp(), dans.Cell.lp())
+    assert list(fast.Atoms.label) == list(dans.Atoms.label)
+    assert list(fast.Atoms.type) == list(dans.Atoms.type)
+    assert np.allclose(fast.Atoms.uvw(), dans.Atoms.uvw(), rtol=0, atol=1e-12)
+    assert np.allclose(fast.Atoms.occupancy, dans.Atoms.occupancy)
+    assert np.allclose(fast.Atoms.uiso, dans.Atoms.uiso)
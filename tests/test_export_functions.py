@@ -0,0 +1,97 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from pyfaults.engine_functions import readCif
+from pyfaults.export_functions import BackgroundWriter, RunArchive, writePattern
+from pyfaults.structure_functions import genSupercells
+from pyfaults.XRD_functions import importFile
+
+
+def test_run_archive_round_trip(unitcell, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    q = np.linspace(0, 5, 11)
+    ints = np.arange(11.0)
+
+    with RunArchive('run.zip', 'w', compress=True) as archive:
+        genSupercells(unitcell, 4, 'B', [0.5], [[1/3, 1/3]], archive=archive)
+        writePattern(archive.patternMember('Unfaulted'), q, ints, archive=archive)
+
+    with RunArchive('run.zip') as archive:
+        assert archive.tags('cif') == ['Unfaulted', 'S1_P50']
+        assert archive.tags('pattern') == ['Unfaulted']
+        assert not archive.exists('supercells/duplicates.txt')
+
+        xyz, elements, occ, biso, lattice = readCif(archive, 'Unfaulted')
+        assert len(xyz) == 4 * 3
+        assert lattice.c == pytest.approx(20.0)
+
+        qRead, intsRead = importFile(archive, 'Unfaulted', norm=False)
+        assert np.allclose(qRead, q) and np.allclose(intsRead, ints)
+
+
+def test_run_archive_rejects_existing_members(tmp_path):
+    with RunArchive(str(tmp_path / 'run.zip'), 'w') as archive:
+        archive.write('notes.txt', 'first')
+        with pytest.raises(ValueError):
+            archive.write('notes.txt', 'second')
+
+    with RunArchive(str(tmp_path / 'run.zip'), 'a') as archive:
+        with pytest.raises(ValueError):
+            archive.write('notes.txt', 'second')
+        assert archive.read('notes.txt') == 'first'
+
+
+def test_BackgroundWriter_flush_waits_in_order():
+    done = []
+
+    def write(i):
+        time.sleep(0.01 * (3 - i))
+        done.append(i)
+
+    with BackgroundWriter(nThreads=1) as writer:
+        for i in range(3):
+            writer.submit(write, i)
+        writer.flush()
+        assert done == [0, 1, 2] and writer.pending == 0
+
+
+def test_BackgroundWriter_raises_earlier_write_error():
+    def fail():
+        raise OSError('disk full')
+
+    writer = BackgroundWriter(nThreads=1)
+    writer.submit(fail)
+    with pytest.raises(OSError, match='disk full'):
+        writer.flush()
+
+    # once the failed write has finished, the next submit raises instead of queueing
+    writer.submit(fail)
+    time.sleep(0.1)
+    with pytest.raises(OSError, match='disk full'):
+        writer.submit(lambda: None)
+
+    writer.submit(fail)
+    with pytest.raises(OSError, match='disk full'):
+        writer.close()
+
+
+def test_BackgroundWriter_blocks_at_maxPending():
+    release = threading.Event()
+    writer = BackgroundWriter(nThreads=1, maxPending=1)
+    writer.submit(release.wait)
+
+    submitted = threading.Event()
+    thread = threading.Thread(target=lambda: (writer.submit(lambda: None), submitted.set()))
+    thread.start()
+    assert not submitted.wait(0.1)
+
+    release.set()
+    assert submitted.wait(5)
+    thread.join()
+    writer.close()
+
+    with pytest.raises(ValueError):
+        BackgroundWriter(nThreads=0)
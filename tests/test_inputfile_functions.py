@@ -0,0 +1,138 @@
+import os
+
+import numpy as np
+import pytest
+
+from pyfaults.inputfile_functions import readInput
+
+inputText = """NAME: test
+TYPE: Displacement
+LATTICE: 3.0, 3.0, 5.0, 90, 90, 120
+NUM LAYERS: 2
+L1: Li1, O1
+L2: Co1
+Li1: Li1+, 0, 0, 0, 1, 1.0
+O1: O2-, 0.333333, 0.666667, 0.2, 1, 0.5
+Co1: Co, 0.666667, 0.333333, 0.5, 1, 0.5
+FAULT LAYER: L2
+PROBABILITY: 0.1, 0.2
+VECTOR: [0.333333, 0.333333, 0]; [0.5, 0, 0]
+N: 100
+WAVELENGTH: 1.5406
+MAX TWO THETA: 60
+BROADENING: 0.02
+TM: L1-L2, 1-P, 0, 0, 0
+TM: L1-L1, P, 0.5, 0, 0
+"""
+
+
+def test_readInput_parses_settings(tmp_path):
+    path = tmp_path / 'input.txt'
+    path.write_text(inputText)
+    settings = readInput(str(path))
+
+    assert settings['name'] == 'test'
+    assert settings['lattice'] == [3.0, 3.0, 5.0, 90.0, 90.0, 120.0]
+    assert settings['layers'] == {'L1': ['Li1', 'O1'], 'L2': ['Co1']}
+    assert settings['atoms']['Co1'] == ['Co', 0.666667, 0.333333, 0.5, 1.0, 0.5]
+    assert settings['probability'] == [0.1, 0.2]
+    assert settings['vector'] == [[0.333333, 0.333333, 0.0], [0.5, 0.0, 0.0]]
+    assert settings['nStacks'] == 100
+    assert settings['transitions'] == [['L1', 'L2', '1-P', 0.0, 0.0, 0.0], ['L1', 'L1', 'P', 0.5, 0.0, 0.0]]
+    assert settings['zAdj'] is None and settings['copyLayers'] == []
+
+
+def test_readInput_caches_until_file_changes(tmp_path, monkeypatch):
+    path = tmp_path / 'input.txt'
+    path.write_text(inputText)
+    first = readInput(str(path))
+
+    # repeated reads, also through a relative path, return the cached parse
+    monkeypatch.chdir(tmp_path)
+    assert readInput('input.txt') == first
+
+    path.write_text(inputText.replace('N: 100', 'N: 200'))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    second = readInput(str(path))
+    assert second['nStacks'] == 200
+
+
+def test_readInput_returns_independent_copies(tmp_path):
+    path = tmp_path / 'input.txt'
+    path.write_text(inputText)
+    first = readInput(str(path))
+    first['name'] = 'changed'
+    first['layers']['L1'].append('Co1')
+    first['atoms']['Co1'][1] = 0.0
+    first['probability'].clear()
+
+    second = readInput(str(path))
+    assert second['name'] == 'test'
+    assert second['layers'] == {'L1': ['Li1', 'O1'], 'L2': ['Co1']}
+    assert second['atoms']['Co1'] == ['Co', 0.666667, 0.333333, 0.5, 1.0, 0.5]
+    assert second['probability'] == [0.1, 0.2]
+
+
+def test_pfInput_builds_unitcell_and_supercells(tmp_path, monkeypatch):
+    from pyfaults.inputfile_functions import pfInput
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'input.txt').write_text(inputText)
+    unitcell, ucDF, gsDF, scDF, simDF = pfInput('input.txt')
+
+    assert unitcell.name == 'test'
+    assert [layer.layerName for layer in unitcell.layers] == ['L1', 'L2']
+    assert unitcell.lattice.c == 5.0
+    assert sorted(os.listdir(tmp_path / 'supercells')) == ['S1_P10.cif', 'S1_P20.cif', 'S2_P10.cif', 'S2_P20.cif',
+                                                           'Unfaulted.cif']
+
+
+def transTable(rows):
+    import pandas as pd
+    return pd.DataFrame(data=rows, columns=['Start Layer', 'Next Layer', 'P', 'x', 'y', 'z'])
+
+
+def test_transSequences_follow_allowed_transitions():
+    from pyfaults.inputfile_functions import compileTransMatrix, transSequences
+
+    table = transTable([['A', 'B', '1-P', 0, 0, 0], ['A', 'A', 'P', 0, 0, 0], ['B', 'A', 1, 0, 0, 0]])
+    states, probMatrix = compileTransMatrix(table, [0.0, 0.5, 1.0])
+    seqs = transSequences(probMatrix, 0, 200, nReal=4, seed=3, states=states)
+
+    assert seqs.shape == (3, 4, 200)
+    # B is always followed by A, A by B at P=0 and by A at P=1
+    assert (seqs[:, :, 1:][seqs[:, :, :-1] == 1] == 0).all()
+    assert (seqs[0, :, ::2] == 0).all() and (seqs[0, :, 1::2] == 1).all()
+    assert (seqs[2] == 0).all()
+    assert 0 < seqs[1].mean() < 0.5
+    assert np.array_equal(seqs, transSequences(probMatrix, 0, 200, nReal=4, seed=3))
+
+
+def test_transSequences_rejects_rows_not_summing_to_one():
+    from pyfaults.inputfile_functions import compileTransMatrix, transSequences
+
+    table = transTable([['A', 'B', 'P', 0, 0, 0], ['B', 'A', 1, 0, 0, 0]])
+    states, probMatrix = compileTransMatrix(table, [0.3])
+    with pytest.raises(ValueError, match="'A' sum to 0.3"):
+        transSequences(probMatrix, 0, 10, states=states)
+
+
+def test_pfInputTransMatrix_builds_one_cell_per_realization(tmp_path):
+    from pyfaults.inputfile_functions import pfInputTransMatrix
+    from pyfaults.structure_classes import Lattice, LayerAtom, Layer
+
+    path = tmp_path / 'input.txt'
+    path.write_text(inputText.replace('TM: L1-L2, 1-P, 0, 0, 0\nTM: L1-L1, P, 0.5, 0, 0\n',
+                                      'TM: L1-L2, 1-P, 0, 0, 0\nTM: L1-L1, P, 0.5, 0, 0\nTM: L2-L1, 1, 0, 0, 0\n'))
+    settings = readInput(str(path))
+    latt = Lattice(*settings['lattice'])
+    atoms = settings['atoms']
+    lyrs = [Layer([LayerAtom(name, a, atoms[a][0], atoms[a][1:4], atoms[a][4], atoms[a][5], latt) for a in labels], latt, name)
+            for name, labels in settings['layers'].items()]
+
+    cells = pfInputTransMatrix(str(path), [0.0, 0.2], lyrs, 5, 'L2', settings['layers'], atoms, latt, nReal=2, seed=0)
+    assert [tag for cell, tag in cells] == ['P0_R1', 'P0_R2', 'P20_R1', 'P20_R2']
+    # without faults the layers alternate L1, L2 through all 5 stacks
+    assert [layer.layerName for layer in cells[0][0].layers] == ['L1', 'L2'] * 5
+    assert cells[0][0].lattice.c == 25.0
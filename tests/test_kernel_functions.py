@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+import pyfaults.kernel_functions as kf
+
+
+def kernelCases():
+    rng = np.random.default_rng(0)
+    xyz = rng.random((500, 3))
+    q = np.sort(rng.random(2000) * 4)
+    ints = rng.random(2000)
+    cumProb = np.cumsum(np.array([[0.2, 0.8, 0.0], [0.5, 0.0, 0.5], [0.0, 0.3, 0.7]]), axis=1)
+    draws = rng.random((20, 300))
+    stacked = np.stack([cumProb, np.cumsum(np.array([[0.9, 0.1, 0.0], [0.0, 0.2, 0.8], [0.4, 0.0, 0.6]]), axis=1)])
+    return {'stackPositions': lambda: kf.stackPositions(xyz, 3, 10, 0.1, np.array([0.3, 0.1, 0.0]), True),
+            'countFaults': lambda: kf.countFaults(rng.integers(0, 101, 1000).astype(float), 25),
+            'maxIndex': lambda: kf.maxIndex(ints),
+            'normalizeWindow': lambda: kf.normalizeWindow(q, ints, 1.0, 1.2),
+            'matchQ': lambda: kf.matchQ(q, q[::3]),
+            'walkSequence': lambda: kf.walkSequence(0, cumProb, draws[0]),
+            'walkSequences': lambda: kf.walkSequences(0, cumProb, draws),
+            'walkSequencesStacked': lambda: kf.walkSequences(0, stacked, draws, matrix=np.arange(20) % 2)}
+
+
+@pytest.mark.skipif(not kf.hasNumba, reason='Numba is not installed')
+@pytest.mark.parametrize('name', sorted(kernelCases()))
+def test_numpy_fallback_matches_numba(name, monkeypatch):
+    # fresh cases per run, so random draws inside a case repeat
+    monkeypatch.setattr(kf, 'useNumba', True)
+    compiled = kernelCases()[name]()
+    monkeypatch.setattr(kf, 'useNumba', False)
+    fallback = kernelCases()[name]()
+
+    # kernels return an array, a number or a tuple of them
+    if not isinstance(compiled, tuple):
+        compiled, fallback = (compiled,), (fallback,)
+    assert len(compiled) == len(fallback)
+    for c, f in zip(compiled, fallback):
+        assert np.array_equal(c, f)
+
+
+def test_matchQ_matches_pairwise_loop():
+    q1 = np.sort(np.random.default_rng(1).random(400) * 2)
+    q2 = q1[::2] + 1e-5
+    for got, expected in zip(kf.matchQ(q1, q2), kf._matchQLoop(q1, q2)):
+        assert np.array_equal(got, expected)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from pyfaults.results_functions import ResultsStore
+from pyfaults.structure_functions import genSupercells
+
+
+@pytest.fixture
+def store(tmp_path):
+    with ResultsStore(str(tmp_path / 'results.db')) as store:
+        yield store
+
+
+def test_topK_orders_scores(store):
+    runId = store.addRun('run')
+    store.addPoints(runId, [['S1_P10', 0.1, 0.3, 0.3, 0.0, 100, 1],
+                            ['S1_P20', 0.2, 0.3, 0.3, 0.0, 100, 1],
+                            ['S2_P10', 0.1, 0.5, 0.0, 0.0, 100, 1]])
+    store.addScores(runId, 'exptA', [['S1_P10', 0.7], ['S1_P20', 0.9], ['S2_P10', 0.8]])
+    store.addScores(runId, 'exptB', [['S1_P10', 0.95]])
+
+    top = store.topK('exptA', 2)
+    assert list(top['tag']) == ['S1_P20', 'S2_P10']
+    assert list(top['r2']) == [0.9, 0.8]
+    assert list(store.topK('exptB')['tag']) == ['S1_P10']
+    assert list(store.slice('exptA', p=0.1)['tag']) == ['S2_P10', 'S1_P10']
+
+    # replacing a score reorders the ranking
+    store.addScores(runId, 'exptA', [['S1_P10', 0.99]])
+    assert store.topK('exptA', 1)['tag'][0] == 'S1_P10'
+
+
+def test_addResults_joins_genSupercells_points(unitcell, store, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sVecList = [[1/3, 1/3], [0.5, 0.0]]
+    runId = store.addRun('run')
+    genSupercells(unitcell, 4, 'B', [0.1, 0.2], sVecList, store=store, runId=runId)
+
+    store.addResults(runId, 'expt', [[0.2, np.array([0.5, 0.0, 0.0]), 0.9], [0.1, [1/3, 1/3], 0.5]], sVecList, nStacks=4)
+
+    top = store.topK('expt', runId=runId)
+    assert list(top['tag']) == ['S2_P20', 'S1_P10']
+    assert np.allclose(top[['p', 'sx', 'sy', 'sz', 'nStacks']].to_numpy(float), [[0.2, 0.5, 0.0, 0.0, 4], [0.1, 1/3, 1/3, 0.0, 4]])
+
+    # the run holds only the points of genSupercells, each with its parameters
+    tags = ['Unfaulted', 'S1_P10', 'S2_P10', 'S1_P20', 'S2_P20']
+    store.addScores(runId, 'all', [[tag, 0.0] for tag in tags])
+    points = store.slice('all', runId=runId)
+    assert sorted(points['tag']) == sorted(tags)
+    assert points['p'].notna().all()
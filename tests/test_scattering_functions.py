@@ -0,0 +1,68 @@
+import numpy as np
+
+from pyfaults.scattering_functions import IncrementalPattern, structureFactor, atomArrays
+
+
+def supercellArrays(unitcell, nStacks, fltLayer, stackVec, faulted):
+    """Atom arrays of a supercell built stack by stack"""
+    xyz, elements, occ, biso = [], [], [], []
+    for n in range(nStacks):
+        for lyr in unitcell.layers:
+            lxyz, lel, locc, lbiso = atomArrays([lyr])
+            lxyz[:,2] = (lxyz[:,2] + n) / nStacks
+            if lyr.layerName == fltLayer and faulted[n]:
+                lxyz = lxyz + stackVec
+            xyz.append(lxyz)
+            elements.append(lel)
+            occ.append(locc)
+            biso.append(lbiso)
+    return np.vstack(xyz), np.concatenate(elements), np.concatenate(occ), np.concatenate(biso)
+
+
+def test_incremental_matches_full_structure_factor(unitcell):
+    nStacks = 12
+    stackVec = np.array([1/3, 1/3, 0])
+    faulted = np.random.default_rng(0).random(nStacks) < 0.3
+    ip = IncrementalPattern(unitcell, nStacks, 'B', stackVec, 1.5406, 60, faulted=faulted)
+
+    # toggle every stack twice, then fault stack 0
+    for n in list(range(nStacks)) * 2:
+        ip.toggleStack(n)
+    ip.toggleStack(0)
+    faulted[0] = not faulted[0]
+
+    full = structureFactor(ip.hkl, ip.qmag, *supercellArrays(unitcell, nStacks, 'B', stackVec, faulted))
+    assert np.allclose(ip.amplitudes, full, rtol=0, atol=1e-9 * np.abs(full).max())
+
+
+def test_single_precision_amplitudes(unitcell):
+    ip = IncrementalPattern(unitcell, 200, 'B', [1/3, 1/3, 0], 1.5406, 60)
+    xyz, elements, occ, biso = supercellArrays(unitcell, 200, 'B', np.zeros(3), np.zeros(200, dtype=bool))
+    double = structureFactor(ip.hkl, ip.qmag, xyz, elements, occ, biso)
+    single = structureFactor(ip.hkl, ip.qmag, xyz, elements, occ, biso, precision='single')
+    assert single.dtype == np.complex64
+    assert np.abs(single - double).max() < 1e-5 * np.abs(double).max()
+
+
+def test_multiPattern_matches_single_wavelength_patterns():
+    from pyfaults.scattering_functions import multiPattern, powderPattern
+    from pyfaults.XRD_functions import tt_to_q
+
+    rng = np.random.default_rng(0)
+    qmag = rng.random(300) * 5
+    ints = rng.random(300)
+    wls = [1.5406, 1.5444]
+
+    patterns = multiPattern(qmag, ints, wls, 90, pw=0.02)
+    for (q, mesh), wl in zip(patterns, wls):
+        expected = powderPattern(qmag, ints, tt_to_q(90, wl), pw=0.02)
+        assert np.array_equal(q, expected[0]) and np.allclose(mesh, expected[1])
+
+    # a doublet is the weighted sum of each line at its apparent position on the Q axis of the first wavelength
+    q, doublet = multiPattern(qmag, ints, wls, 90, weights=[2, 1], pw=0.02)
+    q1, first = multiPattern(qmag, ints, wls[:1], 90, weights=[1], pw=0.02)
+    # the powder averaging correction 1/(Q + 0.001)^2 belongs to the true Q of each reflection
+    shifted = qmag * wls[1] / wls[0]
+    q2, second = multiPattern(shifted, ints * (shifted + 0.001)**2 / (qmag + 0.001)**2, wls[:1], 90, weights=[1], pw=0.02)
+    assert np.array_equal(q, q1)
+    assert np.allclose(doublet, 2*first + second, atol=1e-6 * doublet.max())
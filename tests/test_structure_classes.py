@@ -0,0 +1,40 @@
+import numpy as np
+
+from pyfaults.structure_classes import Supercell
+
+
+def test_supercell_layer_positions(unitcell):
+    cell = Supercell(unitcell, 4, fltLayer='B', stackVec=[1/3, 1/3], stackProb=0.25, zAdj=0.1, sequence=[0, 1, 0, 0])
+
+    assert [layer.layerName for layer in cell.layers] == ['A_n1', 'B_n1', 'A_n2', 'B_n2_fault', 'A_n3', 'B_n3', 'A_n4', 'B_n4']
+    assert cell.nStacks == 4 and cell.fltLayer == 'B' and cell.stackProb == 0.25
+    # c is stretched by nStacks and by zAdj for each fault
+    assert np.isclose(cell.lattice.c, 4 * 5.0 + 0.1)
+
+    # unfaulted layers only move along c, the faulted layer is also displaced by stackVec and zAdj
+    xyz = {layer.layerName: [atom.xyz.tolist() for atom in layer.atoms] for layer in cell.layers}
+    assert np.allclose(xyz['A_n1'], [[0, 0, 0], [1/3, 2/3, 0.05]])
+    assert np.allclose(xyz['A_n3'], [[0, 0, 0.5], [1/3, 2/3, 0.55]])
+    assert np.allclose(xyz['B_n1'], [[2/3, 1/3, 0.125]])
+    assert np.allclose(xyz['B_n2_fault'], [[1.0, 2/3, 1.6 / 4]])
+    assert np.allclose(xyz['B_n4'], [[2/3, 1/3, 0.875]])
+
+
+def test_lattice_geometry_is_cached_until_a_parameter_changes():
+    from pyfaults.structure_classes import Lattice
+
+    latt = Lattice(3.0, 3.0, 5.0, 90, 90, 120)
+    direct, recip = latt.direct, latt.recip
+    assert latt.recip is recip
+    assert np.allclose(direct @ recip.T, np.eye(3))
+    assert np.allclose(latt.metric, [[9.0, -4.5, 0], [-4.5, 9.0, 0], [0, 0, 25.0]])
+
+    # Cartesian round trip, and d-spacings and |Q| of the hexagonal cell
+    xyz = np.array([[1/3, 2/3, 0.25], [0.5, 0.0, 0.5]])
+    assert np.allclose(latt.toFractional(latt.toCartesian(xyz)), xyz)
+    assert np.allclose(latt.dSpacing([[1, 0, 0], [0, 0, 1]]), [3.0 * np.sqrt(3) / 2, 5.0])
+    assert np.allclose(latt.qmag([[0, 0, 2]]), 2*np.pi / 2.5)
+
+    latt.c = 10.0
+    assert latt.recip is not recip
+    assert np.isclose(latt.dSpacing([0, 0, 1]), 10.0)
@@ -0,0 +1,189 @@
+import math
+import os
+
+import numpy as np
+import pytest
+
+from pyfaults.structure_functions import (canonicalSequence, uniqueSequences, genSupercells, iterSupercells, batchSupercells,
+                                         randomSequences, sampleSequences)
+
+
+def test_canonicalSequence_shared_by_cyclic_shifts():
+    sequence = np.array([0, 1, 0, 0, 1, 1, 0, 0, 0, 1], dtype=np.int8)
+    canonical = canonicalSequence(sequence)
+    for shift in range(len(sequence)):
+        assert np.array_equal(canonicalSequence(np.roll(sequence, shift)), canonical)
+    assert sorted(canonical) == sorted(sequence)
+
+
+def test_canonicalSequence_distinguishes_structures():
+    assert not np.array_equal(canonicalSequence([1, 1, 0, 0, 0, 0]), canonicalSequence([1, 0, 1, 0, 0, 0]))
+    assert np.array_equal(canonicalSequence([0, 0, 0]), [0, 0, 0])
+
+
+def test_uniqueSequences():
+    sequences = np.array([[0, 0, 0, 0],
+                          [1, 0, 0, 0],
+                          [0, 0, 1, 0],
+                          [0, 0, 0, 0],
+                          [1, 1, 0, 0],
+                          [1, 0, 0, 0]])
+    vecs = np.array([[0, 0, 0], [1/3, 1/3, 0], [1/3, 1/3, 0], [0.5, 0, 0], [1/3, 1/3, 0], [0.5, 0, 0]])
+
+    unique, inverse = uniqueSequences(sequences)
+    assert list(unique) == [0, 1, 4]
+    assert list(inverse) == [0, 1, 1, 0, 2, 1]
+
+    # unfaulted sequences match whatever their vector, faulted ones only with the same vector
+    unique, inverse = uniqueSequences(sequences, vecs)
+    assert list(unique) == [0, 1, 4, 5]
+    assert list(inverse) == [0, 1, 1, 0, 2, 3]
+
+
+def test_genSupercells_dedupe_is_opt_in(unitcell, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    probList = [0.0, 0.5]
+    sVecList = [[1/3, 1/3], [0.5, 0.0]]
+
+    assert genSupercells(unitcell, 6, 'B', probList, sVecList, commonRandom=True, seed=1) is None
+    assert sorted(os.listdir('supercells')) == ['S1_P0.cif', 'S1_P50.cif', 'S2_P0.cif', 'S2_P50.cif', 'Unfaulted.cif']
+
+    # with common random numbers both P0 supercells share one sequence, which for this seed is unfaulted
+    os.rename('supercells', 'all')
+    assert genSupercells(unitcell, 6, 'B', probList, sVecList, dedupe=True, commonRandom=True, seed=1) == [5, 3]
+    with open('supercells/duplicates.txt') as f:
+        assert f.read().split() == ['S1_P0', 'Unfaulted', 'S2_P0', 'Unfaulted']
+
+
+def test_iterSupercells_seed_reproduces_sequences(unitcell):
+    def sequences(**kwargs):
+        return [cell.sequence.tolist() for tag, params, cell in iterSupercells(unitcell, 20, 'B', [0.2, 0.6], [[1/3, 1/3]],
+                                                                               **kwargs)]
+    assert sequences(seed=3) == sequences(seed=3)
+    assert sequences(seed=3, commonRandom=True) == sequences(seed=3, commonRandom=True)
+
+
+
+def test_iterSupercells_is_lazy_and_chunked(unitcell):
+    # a parameter space far too large to build up front still yields its first supercell at once
+    cells = iterSupercells(unitcell, 4, 'B', np.linspace(0, 1, 10**6), [[1/3, 1/3]], seed=0)
+    tag, params, cell = next(cells)
+    assert tag == 'Unfaulted' and params == [0.0, None] and cell.nStacks == 4
+    assert next(cells)[0] == 'S1_P0'
+
+    probList, sVecList = [0.1, 0.2, 0.3], [[1/3, 1/3], [0.5, 0.0]]
+    single = [(tag, cell.sequence.tolist()) for tag, params, cell in iterSupercells(unitcell, 8, 'B', probList, sVecList, seed=4)]
+    chunks = list(iterSupercells(unitcell, 8, 'B', probList, sVecList, chunk=3, seed=4))
+    assert [len(batch) for batch in chunks] == [3, 3, 1]
+    assert [(tag, cell.sequence.tolist()) for batch in chunks for tag, params, cell in batch] == single
+
+def test_iterSupercells_fault_rule_shared_by_all_modes(unitcell):
+    # every mode faults a stack when a random integer from 0 to 100 is at or below 100 p, as Supercell.assignProb does
+    nStacks = 3000
+    np.random.seed(0)
+    for kwargs in [{}, {'seed': 1}, {'seed': 1, 'commonRandom': True}]:
+        cells = iterSupercells(unitcell, nStacks, 'B', [0.0, 0.5, 1.0], [[1/3, 1/3]], **kwargs)
+        fractions = [cell.sequence.mean() for tag, params, cell in cells][1:]
+        assert abs(fractions[0] - 1/101) < 0.006
+        assert abs(fractions[1] - 51/101) < 0.04
+        assert fractions[2] == 1.0
+
+
+def test_batch_and_random_sequences_match_iterSupercells(unitcell):
+    probList = [0.0, 0.3, 0.7]
+    sVecList = [[1/3, 1/3], [0.5, 0.0]]
+    for commonRandom in [False, True]:
+        expected = [cell.sequence.tolist() for tag, params, cell in iterSupercells(unitcell, 40, 'B', probList, sVecList,
+                                                                                 commonRandom=commonRandom, seed=2)]
+        tags, sequences = batchSupercells(unitcell, 40, 'B', probList, sVecList, commonRandom=commonRandom, seed=2)[:2]
+        assert sequences.tolist() == expected
+
+    tags, sequences = batchSupercells(unitcell, 40, 'B', [0.3], sVecList * 2, seed=5)[:2]
+    assert np.array_equal(randomSequences(40, 0.3, size=4, seed=5), sequences[1:])
+
+
+
+def test_sampleSequences_stratifies_fault_counts():
+    nStacks, p, size = 200, 0.3, 50
+    sequences, weights = sampleSequences(nStacks, p, size, seed=0)
+    assert sequences.shape == (size, nStacks) and sequences.dtype == np.int8
+    assert np.allclose(weights, 1 / size)
+
+    # one fault count from each of size equal-probability strata of the binomial distribution
+    k = np.arange(nStacks + 1)
+    cdf = np.cumsum([math.comb(nStacks, i) * p**i * (1 - p)**(nStacks - i) for i in k])
+    counts = np.sort(sequences.sum(axis=1))
+    lower = np.searchsorted(cdf, np.arange(size) / size - 1e-9)
+    upper = np.searchsorted(cdf, (np.arange(size) + 1) / size + 1e-9)
+    assert np.all((counts >= lower) & (counts <= upper))
+
+    # the same seed nests the faults of a larger probability around those of a smaller one
+    more, weights = sampleSequences(nStacks, 0.5, size, seed=0)
+    assert np.all(more >= sequences)
+
+    with pytest.raises(ValueError):
+        sampleSequences(nStacks, p, size, sampling='latin')
+
+def test_writeCif_chunks_give_identical_output(tmp_path):
+    from pyfaults.structure_classes import Lattice
+    from pyfaults.structure_functions import writeCif
+
+    rng = np.random.default_rng(0)
+    nAtoms = 50
+    lattice = Lattice(3.0, 3.0, 50.0, 90, 90, 120)
+    args = (lattice, ['Co' + str(i) for i in range(nAtoms)], np.array(['Co'] * nAtoms), rng.random((nAtoms, 3)),
+            rng.random(nAtoms), np.ones(nAtoms))
+
+    texts = []
+    for chunk in (1, 7, nAtoms):
+        writeCif(str(tmp_path / 'cell.cif'), *args, chunk=chunk)
+        texts.append((tmp_path / 'cell.cif').read_text())
+    assert texts[0] == texts[1] == texts[2]
+    assert sum(' Biso ' in line for line in texts[0].splitlines()) == nAtoms
+
+
+def test_writeCif_memory_bounded_by_chunk(tmp_path):
+    import tracemalloc
+    from pyfaults.structure_classes import Lattice
+    from pyfaults.structure_functions import writeCif
+
+    nAtoms = 50000
+    labels = np.array(['Co1_B'] * nAtoms)
+    elements = np.array(['Co'] * nAtoms)
+    xyz = np.random.default_rng(0).random((nAtoms, 3))
+    ones = np.ones(nAtoms)
+    lattice = Lattice(3.0, 3.0, 50.0, 90, 90, 120)
+
+    tracemalloc.start()
+    try:
+        writeCif(str(tmp_path / 'cell.cif'), lattice, labels, elements, xyz, ones, ones, chunk=1000)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # the whole atom table is ~3.7 MB of text and several times that as Python objects
+    assert peak < 1.5 * 2**20
+
+
+def test_importCSV_groups_interleaved_layer_rows(tmp_path):
+    from pyfaults.structure_functions import importCSV
+
+    rows = ['Layer,Atom,Element,x,y,z,Occupancy,Biso',
+            'A,Li1,Li1+,0,0,0,1,1.0',
+            'B,Co1,Co,0.6667,0.3333,0.5,1,0.5',
+            'A,O1,O2-,0.3333,0.6667,0.2,0.9,0.5']
+    (tmp_path / 'cell.csv').write_text('\n'.join(rows) + '\n')
+
+    cell = importCSV(str(tmp_path) + '/', 'cell', [3, 3, 5, 90, 90, 120], ['A', 'B'])
+    assert [lyr.layerName for lyr in cell.layers] == ['A', 'B']
+
+    layerA, layerB = cell.layers
+    xyz, elements, occ, biso = layerA.atomArrays()
+    assert list(elements) == ['Li1+', 'O2-']
+    assert np.allclose(xyz, [[0, 0, 0], [0.3333, 0.6667, 0.2]])
+    assert np.allclose(occ, [1, 0.9]) and np.allclose(biso, [1.0, 0.5])
+
+    # atoms built on first access carry the same parameters as the arrays
+    assert [a.atomLabel for a in layerA.atoms] == ['Li1_A', 'O1_A']
+    assert np.allclose([a.xyz for a in layerA.atoms], xyz)
+    assert [a.atomLabel for a in layerB.atoms] == ['Co1_B'] and layerB.atoms[0].layerName == 'B'
+    assert (tmp_path / 'cell.cif').exists()